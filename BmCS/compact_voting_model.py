@@ -0,0 +1,106 @@
+import joblib
+import numpy as np
+import os
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+
+ENSEMBLE_FILENAME = "pipeline.joblib"
+ENSEMBLE_COMPRESSION = 3
+TERM_WIDTH = 32 # Bytes. Longer terms, which are rare, are kept in a dict.
+VECTORIZERS_FILENAME = "vectorizers.joblib"
+
+
+class CompactTfidfVectorizer(TfidfVectorizer):
+    """Fitted TfidfVectorizer with an array backed vocabulary.
+
+    Terms are stored as a sorted array of UTF-8 bytes, with the feature index of each
+    term, and looked up with a binary search. Unlike the vocabulary_ dict the arrays can be
+    memory mapped (joblib.load(..., mmap_mode="r")), so loading does not rebuild the dict.
+    transform gives the same features as the TfidfVectorizer it was created from, applying
+    the fitted IDF weights (idf_weights_) and the norm and sublinear_tf parameters itself.
+    Vectorizers with binary=True, a fixed vocabulary or a dtype other than float64 are not supported.
+    """
+
+    @classmethod
+    def from_vectorizer(cls, vectorizer):
+        if vectorizer.binary:
+            raise ValueError("CompactTfidfVectorizer does not support binary=True")
+        if vectorizer.vocabulary is not None:
+            raise ValueError("CompactTfidfVectorizer does not support a fixed vocabulary")
+        if np.dtype(vectorizer.dtype) != np.float64:
+            raise ValueError(f"CompactTfidfVectorizer does not support dtype {np.dtype(vectorizer.dtype).name}, only float64")
+        compact_vectorizer = cls(**vectorizer.get_params())
+        compact_vectorizer.idf_weights_ = np.asarray(vectorizer.idf_) if vectorizer.use_idf else None
+        terms = np.array(list(vectorizer.vocabulary_), dtype=object)
+        term_indices = np.fromiter(vectorizer.vocabulary_.values(), dtype=np.int64, count=len(terms))
+        encoded_terms = np.array([term.encode("utf8") for term in terms], dtype=object)
+        is_short = np.array([len(encoded_term) <= TERM_WIDTH for encoded_term in encoded_terms], dtype=bool)
+        short_terms = encoded_terms[is_short].astype(f"S{TERM_WIDTH}")
+        order = np.argsort(short_terms)
+        compact_vectorizer.terms_ = short_terms[order]
+        compact_vectorizer.term_indices_ = term_indices[is_short][order].astype(np.int32)
+        compact_vectorizer.long_terms_ = dict(zip(terms[~is_short].tolist(), term_indices[~is_short].tolist()))
+        compact_vectorizer.num_features_ = len(terms)
+        return compact_vectorizer
+
+    def transform(self, raw_documents):
+        analyze = self.build_analyzer()
+        tokens = []
+        indptr = [0]
+        for doc in raw_documents:
+            tokens.extend(analyze(doc))
+            indptr.append(len(tokens))
+        num_docs = len(indptr) - 1
+
+        # Binary search of all the tokens at once. Long tokens would be truncated by the fixed width, so they are looked up separately.
+        encoded_tokens = [token.encode("utf8") for token in tokens]
+        is_long = np.fromiter((len(encoded_token) > TERM_WIDTH for encoded_token in encoded_tokens), dtype=bool, count=len(tokens))
+        indices = np.full(len(tokens), -1, dtype=np.int64)
+        if len(self.terms_) > 0 and len(tokens) > 0:
+            encoded_tokens = np.array(encoded_tokens, dtype=self.terms_.dtype)
+            positions = np.minimum(self.terms_.searchsorted(encoded_tokens), len(self.terms_) - 1)
+            is_found = (self.terms_[positions] == encoded_tokens) & ~is_long
+            indices[is_found] = self.term_indices_[positions[is_found]]
+        for idx in np.flatnonzero(is_long):
+            indices[idx] = self.long_terms_.get(tokens[idx], -1)
+
+        rows = np.repeat(np.arange(num_docs), np.diff(indptr))
+        is_known = indices >= 0
+        counts = sparse.coo_matrix((np.ones(is_known.sum(), dtype=self.dtype), (rows[is_known], indices[is_known])), shape=(num_docs, self.num_features_)).tocsr() # Sums the counts of repeated terms
+        # As TfidfTransformer.transform computes them
+        if self.sublinear_tf:
+            np.log(counts.data, counts.data)
+            counts.data += 1
+        if self.idf_weights_ is not None:
+            counts.data *= self.idf_weights_[counts.indices]
+        if self.norm is not None:
+            counts = normalize(counts, norm=self.norm, copy=False)
+        return counts
+
+
+def load_compact_voting_model(dirpath, mmap_mode="r"):
+    """Returns the voting model pipeline saved by save_compact_voting_model."""
+    pipeline = joblib.load(os.path.join(dirpath, ENSEMBLE_FILENAME))
+    vectorizers = joblib.load(os.path.join(dirpath, VECTORIZERS_FILENAME), mmap_mode=mmap_mode)
+    for (_, transformer), vectorizer in zip(pipeline.named_steps["union"].transformer_list, vectorizers):
+        transformer.steps[-1] = (transformer.steps[-1][0], vectorizer)
+    return pipeline
+
+
+def save_compact_voting_model(pipeline, dirpath):
+    """Saves a voting model pipeline with compact vectorizers (uncompressed, so they can be memory mapped) and the rest compressed."""
+    os.makedirs(dirpath, exist_ok=True)
+    vectorizers = []
+    pipeline_steps = []
+    for _, transformer in pipeline.named_steps["union"].transformer_list:
+        vectorizers.append(CompactTfidfVectorizer.from_vectorizer(transformer.steps[-1][1]))
+        pipeline_steps.append((transformer, transformer.steps[-1]))
+        transformer.steps[-1] = (transformer.steps[-1][0], None) # Saved separately
+    try:
+        joblib.dump(pipeline, os.path.join(dirpath, ENSEMBLE_FILENAME), compress=ENSEMBLE_COMPRESSION)
+    finally:
+        for transformer, step in pipeline_steps:
+            transformer.steps[-1] = step
+    joblib.dump(vectorizers, os.path.join(dirpath, VECTORIZERS_FILENAME))
@@ -4,6 +4,8 @@ from . import run_all
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--workdir", dest="workdir", help="The working directory.")
+parser.add_argument("--jobs", dest="jobs", type=int, default=1, help="The number of worker processes to use for CPU bound preprocessing steps.")
 args = parser.parse_args()
 workdir = args.workdir
-run_all.run(workdir, cfg.USE_EUTILS)
\ No newline at end of file
+jobs = args.jobs
+run_all.run(workdir, cfg.USE_EUTILS, jobs)
\ No newline at end of file
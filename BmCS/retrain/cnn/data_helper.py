@@ -1,9 +1,63 @@
-from datetime import datetime as dt
+from ..helper import get_year_completed
+from itertools import chain
 import math
-from nltk.tokenize import word_tokenize
 import numpy as np
-from tensorflow.keras.preprocessing.sequence import pad_sequences
+import tensorflow as tf
 from tensorflow.keras.utils import Sequence
+from ..token_cache import tokenize
+
+
+def create_tf_dataset(data_generator, tf_data_config, shuffle, num_shards=1, shard_index=0, batch_multiple=1):
+    """Wraps a DataGenerator in a tf.data pipeline.
+
+    Batches are assembled by the generator in parallel map calls, optionally
+    cached after the first epoch, shuffled at the batch level and prefetched.
+    With more than one shard (one per worker), the shard takes every num_shards-th
+    batch. All shards get the same number of batches, a multiple of batch_multiple
+    (e.g. the number of replicas of a worker), so a few batches are repeated when
+    the number of batches is not a multiple of num_shards*batch_multiple.
+    If the generator's batches change every epoch (shuffled length buckets), the dataset
+    is endless and asks the generator for the batches of each epoch in turn.
+    """
+    num_batches = len(data_generator)
+    num_shard_batches = math.ceil(num_batches/(num_shards*batch_multiple))*batch_multiple
+    sample_x, sample_y = data_generator[0]
+    names = list(sample_x)
+    dtypes = [tf.as_dtype(sample_x[name].dtype) for name in names] + [tf.as_dtype(sample_y.dtype)]
+    shapes = [(None,)*sample_x[name].ndim if name in data_generator.variable_length_inputs else (None,) + sample_x[name].shape[1:] for name in names] + [(None,) + sample_y.shape[1:]]
+
+    def get_batch(epoch, idx):
+        batch_x, batch_y = data_generator.get_batch(int(idx) % num_batches, int(epoch))
+        return [batch_x[name] for name in names] + [batch_y]
+
+    def load_batch(epoch, idx):
+        tensors = tf.numpy_function(get_batch, [epoch, idx], dtypes)
+        for tensor, shape in zip(tensors, shapes):
+            tensor.set_shape(shape)
+        return dict(zip(names, tensors[:-1])), tensors[-1]
+
+    shuffle_buffer_size = max(tf_data_config.shuffle_buffer_size or num_batches, 1)
+    indices = tf.data.Dataset.range(shard_index, num_shard_batches*num_shards, num_shards)
+    if shuffle and not tf_data_config.cache:
+        indices = indices.shuffle(shuffle_buffer_size, reshuffle_each_iteration=True) # Shuffle indices, not batches
+    if data_generator.reshuffles_each_epoch:
+        if tf_data_config.cache:
+            raise ValueError('tf_data.cache cannot be used with shuffled abstract buckets, as the batches change every epoch')
+        # keras does not call on_epoch_end for a dataset, so each batch index is paired with its epoch
+        dataset = tf.data.experimental.Counter().flat_map(lambda epoch: indices.map(lambda idx: (epoch, idx)))
+    else:
+        dataset = indices.map(lambda idx: (tf.constant(0, tf.int64), idx))
+    dataset = dataset.map(load_batch, num_parallel_calls=tf_data_config.num_parallel_calls)
+    if tf_data_config.cache:
+        dataset = dataset.cache(tf_data_config.cache_filename)
+        if shuffle:
+            dataset = dataset.shuffle(shuffle_buffer_size, reshuffle_each_iteration=True)
+    dataset = dataset.prefetch(tf_data_config.prefetch_buffer_size)
+
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF # Sharded above
+    dataset = dataset.with_options(options)
+    return dataset
 
 
 def set_vocab_size(word_index_lookup, vocab_size):
@@ -14,98 +68,217 @@ def set_vocab_size(word_index_lookup, vocab_size):
     return modified_lookup
 
 
-def tokenize(text):
-    text = text.lower()
-    tokens = word_tokenize(text)
-    return tokens
+class DataGenerator(Sequence):
+    """Keras sequence of CNN input batches.
 
+    The per-article inputs (pmid, year period indices, journal id and label) are
+    computed once when the generator is created, so a batch is assembled by
+    slicing preallocated columns. Word indices come from the token cache if one is
+    given, otherwise the titles and abstracts are tokenized batch by batch.
 
-class DataGenerator(Sequence):
+    If pp_config.bucket_abstracts is set, articles with abstracts of similar length
+    are batched together and abstracts are only padded to the longest abstract in
+    the batch (rounded up to the bucket granularity). This requires a token cache.
+    """
 
-    def __init__(self, pp_config, word_index_lookup, journal_id_lookup, data_set, batch_size, max_examples = 1000000000, tokenizer=tokenize):
+    def __init__(self, pp_config, word_index_lookup, journal_id_lookup, data_set, batch_size, max_examples = 1000000000, tokenizer=tokenize, token_cache=None, shuffle=False):
         self._pp_config = pp_config
         self._word_index_lookup = word_index_lookup
         self._journal_id_lookup = journal_id_lookup
         self._data_set = data_set
         self._batch_size = batch_size 
         self._tokenizer = tokenizer
+        self._token_cache = token_cache
+        self._shuffle = shuffle
         self._num_examples = min(len(data_set), max_examples)
+        if token_cache is not None:
+            assert(len(token_cache) == len(data_set))
+            self._max_word_index = max(word_index_lookup.values(), default=pp_config.unknown_word_index)
+        self._init_columns()
+        self._sampler = None
+        if pp_config.bucket_abstracts:
+            if token_cache is None:
+                raise ValueError('Bucketed abstracts require a token cache')
+            offsets = np.asarray(token_cache.offsets[:2*self._num_examples + 1])
+            self._abstract_lengths = np.minimum(offsets[2::2] - offsets[1:-1:2], pp_config.abstract_max_words)
+            self._sampler = LengthBucketSampler(self._abstract_lengths, batch_size, pp_config.abstract_bucket_granularity, shuffle, pp_config.abstract_bucket_seed)
    
     def __len__(self):
         length = int(math.ceil(self._num_examples/self._batch_size))
         return length
 
+    @property
+    def labels(self):
+        return self._labels[self._example_indices]
+
+    @property
+    def pmids(self):
+        return self._pmids[self._example_indices]
+
+    @property
+    def variable_length_inputs(self):
+        return ['abstract_input'] if self._sampler is not None else []
+
+    @property
+    def _example_indices(self):
+        # The examples in the order of the batches
+        if self._sampler is not None:
+            return self._sampler.order
+        return np.arange(min(len(self)*self._batch_size, len(self._data_set)))
+
+    @property
+    def reshuffles_each_epoch(self):
+        return self._sampler is not None and self._shuffle
+
     def __getitem__(self, idx):
-        batch_start_index = idx * self._batch_size
-        batch_end_index = (idx + 1) * self._batch_size
+        return self.get_batch(idx)
 
-        pmid, title, abstract, pub_year, year_completed, journal_id, is_indexed = self._get_batch_data(batch_start_index, batch_end_index)
-        
-        title_input = self._vectorize_batch_text(title, self._pp_config.title_max_words)
-        abstract_input = self._vectorize_batch_text(abstract, self._pp_config.abstract_max_words)
+    def get_batch(self, idx, epoch=None):
+        """Returns batch idx, of the given epoch if the batches change every epoch, otherwise of the current one."""
+        if self._sampler is not None:
+            batch_indices = self._sampler.get_batch(idx, epoch)
+            abstract_max_words = self._get_padded_abstract_length(batch_indices)
+        else:
+            # The last batch is not cut off at max_examples
+            batch_start_index = min(idx * self._batch_size, len(self._data_set))
+            batch_end_index = min((idx + 1) * self._batch_size, len(self._data_set))
+            batch_indices = np.arange(batch_start_index, batch_end_index)
+            abstract_max_words = self._pp_config.abstract_max_words
 
-        pub_year_input =       self._create_year_input(pub_year      , self._pp_config.min_pub_year      , self._pp_config.max_pub_year      , self._pp_config.num_pub_year_time_periods      )
-        year_completed_input = self._create_year_input(year_completed, self._pp_config.min_year_completed, self._pp_config.max_year_completed, self._pp_config.num_year_completed_time_periods)
+        if self._token_cache is not None:
+            title_input = self._vectorize_batch_token_ids(0, batch_indices, self._pp_config.title_max_words)
+            abstract_input = self._vectorize_batch_token_ids(1, batch_indices, abstract_max_words)
+        else:
+            batch = [self._data_set[idx] for idx in batch_indices]
+            title_input = self._vectorize_batch_text([article["title"] for article in batch], self._pp_config.title_max_words)
+            abstract_input = self._vectorize_batch_text([article["abstract"] for article in batch], abstract_max_words)
 
-        journal_input = np.array(journal_id, dtype=np.int32).reshape(-1, 1)
+        pub_year_input = self._to_time_period_input(self._pub_year_indices[batch_indices], self._pp_config.num_pub_year_time_periods)
+        year_completed_input = self._to_time_period_input(self._year_completed_indices[batch_indices], self._pp_config.num_year_completed_time_periods)
 
-        pmid_input = np.array(pmid, dtype=np.int32).reshape(-1, 1)
+        journal_input = self._journal_ids[batch_indices]
+
+        pmid_input = self._pmids[batch_indices]
 
         batch_x = { 'pmids': pmid_input, 'title_input': title_input, 'abstract_input': abstract_input, 'pub_year_input': pub_year_input, 'year_completed_input': year_completed_input, 'journal_input': journal_input}
     
-        is_indexed = np.array(is_indexed, dtype=np.float32).reshape(-1, 1)
-
-        batch_y = is_indexed
+        batch_y = self._labels[batch_indices]
         
         return batch_x, batch_y
 
-    def _create_year_input(self, year_data, min_year, max_year, num_time_periods):
-        year_data = np.array(year_data, dtype=np.int32).reshape(-1, 1)
+    def on_epoch_end(self):
+        if self._sampler is not None and self._shuffle:
+            self._sampler.shuffle()
+
+    def _create_year_indices(self, year_data, min_year, max_year, num_time_periods):
+        year_data = np.array(year_data, dtype=np.int32)
         year_data = np.clip(year_data, a_min=min_year, a_max=max_year)
         year_indices = max_year - year_data
         year_indices = np.floor_divide(year_indices, self._pp_config.time_period_size)
         year_indices = num_time_periods - year_indices - 1
-        year_input = self._to_time_period_input(year_indices, num_time_periods)
-        return year_input
-
-    def _get_batch_data(self, start_index, end_index):
-        inputs = []
-        for article in self._data_set[start_index: end_index]:
-            pmid = article["pmid"]
-            title = article["title"]
-            abstract = article["abstract"]
-            
-            pub_year = article["pub_year"]
-            
-            if article["date_completed"]:
-                year_completed = dt.strptime(article["date_completed"], self._pp_config.date_format).date().year
-            elif article["bmcs_processed_date"]:
-                year_completed = dt.strptime(article["bmcs_processed_date"], self._pp_config.date_format).date().year
-            else:
-                year_completed = article["pub_year"]
-            
-            nlmid = article["journal_nlmid"]
-            journal_id = self._journal_id_lookup[nlmid] if nlmid in self._journal_id_lookup else self._pp_config.unknown_journal_index
-            is_indexed = article["is_indexed"]
-            
-            inputs.append([pmid, title, abstract, pub_year, year_completed, journal_id, is_indexed])
-        return zip(*inputs)
+        return year_indices
+
+    def _get_padded_abstract_length(self, batch_indices):
+        granularity = self._pp_config.abstract_bucket_granularity
+        max_length = self._abstract_lengths[batch_indices].max() if len(batch_indices) > 0 else 0
+        padded_length = int(math.ceil(max_length/granularity))*granularity
+        padded_length = min(max(padded_length, self._pp_config.abstract_bucket_min_words), self._pp_config.abstract_max_words)
+        return padded_length
+
+    def _init_columns(self):
+        num_articles = len(self._data_set)
+        unknown_journal_index = self._pp_config.unknown_journal_index
+        pmids = np.empty(num_articles, dtype=np.int32)
+        pub_years = np.empty(num_articles, dtype=np.int32)
+        years_completed = np.empty(num_articles, dtype=np.int32)
+        journal_ids = np.empty(num_articles, dtype=np.int32)
+        labels = np.empty(num_articles, dtype=np.float32)
+        for idx, article in enumerate(self._data_set):
+            pmids[idx] = article["pmid"]
+            pub_years[idx] = article["pub_year"]
+            years_completed[idx] = get_year_completed(article, self._pp_config.date_format)
+            journal_ids[idx] = self._journal_id_lookup.get(article["journal_nlmid"], unknown_journal_index)
+            labels[idx] = article["is_indexed"]
+
+        self._pmids = pmids.reshape(-1, 1)
+        self._journal_ids = journal_ids.reshape(-1, 1)
+        self._labels = labels.reshape(-1, 1)
+        self._pub_year_indices = self._create_year_indices(pub_years, self._pp_config.min_pub_year, self._pp_config.max_pub_year, self._pp_config.num_pub_year_time_periods)
+        self._year_completed_indices = self._create_year_indices(years_completed, self._pp_config.min_year_completed, self._pp_config.max_year_completed, self._pp_config.num_year_completed_time_periods)
+
+    def _pad_token_ids(self, token_ids, starts, lengths, max_words):
+        # Copies token_ids[starts[i]:starts[i] + lengths[i]], truncated to max_words, into row i
+        lengths = np.minimum(lengths, max_words)
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        row_starts = np.cumsum(lengths) - lengths
+        cols = np.arange(len(rows)) - np.repeat(row_starts, lengths)
+        vectorized_text = np.full((len(lengths), max_words), self._pp_config.padding_index, dtype=np.int32)
+        vectorized_text[rows, cols] = token_ids[np.repeat(starts, lengths) + cols]
+        return vectorized_text
 
     def _to_time_period_input(self, year_indices, num_time_periods):
-        batch_size = year_indices.shape[0]
-        batch_indices = np.zeros([batch_size, num_time_periods], np.int32)
-        batch_indices[np.arange(batch_size)] = np.arange(num_time_periods)
-        year_indices_rep = np.repeat(year_indices, num_time_periods, axis=1)
-        time_period_input = batch_indices <= year_indices_rep
-        time_period_input = time_period_input.astype(np.int32)
+        time_period_input = (np.arange(num_time_periods) <= year_indices[:, None]).astype(np.int32)
         return time_period_input
 
     def _vectorize_batch_text(self, batch_text, max_words):
-        batch_words = [self._tokenizer(text) for text in batch_text]
-        batch_word_indices = [[self._word_to_index(word) for word in words] for words in batch_words]
-        vectorized_text = pad_sequences(batch_word_indices, maxlen=max_words, dtype='int32', padding='post', truncating='post', value=self._pp_config.padding_index)
+        batch_word_indices = [[self._word_to_index(word) for word in self._tokenizer(text)] for text in batch_text]
+        lengths = np.array([len(word_indices) for word_indices in batch_word_indices], dtype=np.int64)
+        starts = np.cumsum(lengths) - lengths
+        token_ids = np.fromiter(chain.from_iterable(batch_word_indices), dtype=np.int32, count=int(lengths.sum()))
+        vectorized_text = self._pad_token_ids(token_ids, starts, lengths, max_words)
+        return vectorized_text
+
+    def _vectorize_batch_token_ids(self, field, batch_indices, max_words):
+        # Title i spans offsets[2*i]:offsets[2*i + 1] and abstract i spans offsets[2*i + 1]:offsets[2*i + 2]
+        offsets = self._token_cache.offsets
+        starts = np.asarray(offsets[2*batch_indices + field])
+        lengths = np.asarray(offsets[2*batch_indices + field + 1]) - starts
+        vectorized_text = self._pad_token_ids(self._token_cache.ids, starts, lengths, max_words)
+        vectorized_text[vectorized_text > self._max_word_index] = self._pp_config.unknown_word_index # Outside of the vocabulary
         return vectorized_text
 
     def _word_to_index(self, word):
         index = self._word_index_lookup[word] if word in self._word_index_lookup else self._pp_config.unknown_word_index
-        return index
\ No newline at end of file
+        return index
+
+
+class LengthBucketSampler:
+    """Orders examples into batches of similar length.
+
+    Lengths are rounded up to a multiple of the granularity, the examples are
+    sorted by rounded length and the sorted order is cut into batches. Ties are
+    broken randomly when shuffling, otherwise by position, so the order is
+    deterministic if shuffle is False. The random order of an epoch only depends
+    on the seed and the epoch, so all workers of a distributed run agree on it.
+    """
+
+    def __init__(self, lengths, batch_size, granularity, shuffle=False, seed=0):
+        self._buckets = -(-np.asarray(lengths) // granularity)
+        self._batch_size = batch_size
+        self._random_shuffle = shuffle
+        self._seed = seed
+        self._orders = {}
+        self._epoch = 0
+        self.order = self.get_order(self._epoch)
+
+    def __len__(self):
+        return int(math.ceil(len(self._buckets)/self._batch_size))
+
+    def get_batch(self, idx, epoch=None):
+        order = self.order if epoch is None else self.get_order(epoch)
+        return order[idx*self._batch_size:(idx + 1)*self._batch_size]
+
+    def get_order(self, epoch):
+        if not self._random_shuffle:
+            epoch = 0
+        order = self._orders.get(epoch)
+        if order is None:
+            tie_breakers = np.random.default_rng([self._seed, epoch]).random(len(self._buckets)) if self._random_shuffle else np.arange(len(self._buckets))
+            order = np.lexsort((tie_breakers, self._buckets))
+            # Parallel batch loads may still be finishing the previous epoch
+            self._orders = { **{ cached_epoch: cached_order for cached_epoch, cached_order in self._orders.items() if cached_epoch >= epoch - 1 }, epoch: order }
+        return order
+
+    def shuffle(self):
+        self._epoch += 1
+        self.order = self.get_order(self._epoch)
@@ -0,0 +1,72 @@
+from .data_helper import create_tf_dataset
+import math
+import tensorflow as tf
+
+
+def create_distributed_dataset(strategy, data_generator, tf_data_config, shuffle):
+    """Returns a repeating tf.data pipeline of the generator's batches and the number of steps per epoch.
+
+    Every batch goes to one replica. With a strategy, each worker reads its own shard of the
+    batches and its replicas take consecutive batches, so a step uses num_replicas_in_sync
+    batches. The batches are not rebatched, unlike a dataset passed to keras directly.
+    """
+    num_workers, _ = get_worker_info(strategy)
+    num_local_replicas = strategy.num_replicas_in_sync // num_workers if strategy is not None else 1
+    num_steps = math.ceil(len(data_generator)/(num_workers*num_local_replicas))
+
+    def dataset_fn(input_context):
+        if input_context.num_input_pipelines != num_workers:
+            raise ValueError(f'Expected {num_workers} input pipelines, got {input_context.num_input_pipelines}')
+        return create_tf_dataset(data_generator, tf_data_config, shuffle, input_context.num_input_pipelines, input_context.input_pipeline_id, num_local_replicas).repeat()
+
+    if strategy is None:
+        dataset = create_tf_dataset(data_generator, tf_data_config, shuffle).repeat()
+    else:
+        dataset = strategy.distribute_datasets_from_function(dataset_fn)
+    return dataset, num_steps
+
+
+def configure_devices(distribute_config):
+    """Creates the logical CPUs of a mirrored strategy on CPUs. Call it early, before any step initializes TensorFlow."""
+    if distribute_config.strategy == 'mirrored' and distribute_config.num_cpu_replicas > 0:
+        _create_logical_cpus(distribute_config.num_cpu_replicas)
+
+
+def create_strategy(distribute_config):
+    if distribute_config.strategy is None:
+        strategy = None
+    elif distribute_config.strategy == 'mirrored':
+        devices = _create_logical_cpus(distribute_config.num_cpu_replicas) if distribute_config.num_cpu_replicas > 0 else None
+        strategy = tf.distribute.MirroredStrategy(devices)
+    elif distribute_config.strategy == 'multi_worker_mirrored':
+        strategy = tf.distribute.MultiWorkerMirroredStrategy() # The cluster is read from the TF_CONFIG environment variable
+    else:
+        raise ValueError(f'Unknown distribution strategy: {distribute_config.strategy}')
+    return strategy
+
+
+def get_worker_info(strategy):
+    """Returns the number of workers and the index of this worker, with the chief (if any) first."""
+    cluster_resolver = getattr(strategy, 'cluster_resolver', None)
+    cluster = cluster_resolver.cluster_spec().as_dict() if cluster_resolver is not None else {}
+    if not cluster:
+        return 1, 0
+    num_chiefs = len(cluster.get('chief', []))
+    num_workers = num_chiefs + len(cluster.get('worker', []))
+    worker_index = cluster_resolver.task_id + (num_chiefs if cluster_resolver.task_type == 'worker' else 0)
+    return num_workers, worker_index
+
+
+def _create_logical_cpus(num_cpus):
+    # Logical devices can only be configured before the TensorFlow runtime is initialized, which an
+    # earlier step in the same process may have done. Listing the logical devices initializes it too.
+    physical_cpu = tf.config.list_physical_devices('CPU')[0]
+    try:
+        tf.config.set_logical_device_configuration(physical_cpu, [tf.config.LogicalDeviceConfiguration() for _ in range(num_cpus)])
+    except RuntimeError:
+        pass # Already initialized, the existing devices are used if there are enough
+    devices = [device.name for device in tf.config.list_logical_devices('CPU')]
+    if len(devices) < num_cpus:
+        raise RuntimeError(f'{num_cpus} CPU replicas were requested, but the TensorFlow runtime was already initialized with {len(devices)} CPU device(s). '
+                           'Train the CNN in a new process, or set train.distribute.num_cpu_replicas to 0.')
+    return devices[:num_cpus]
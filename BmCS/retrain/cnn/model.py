@@ -1,6 +1,10 @@
 from .f_scores import F1Score
+import glob
+import numpy as np
 from os import mkdir
 import os.path as os_path
+import tensorflow as tf
+from tensorflow.keras import mixed_precision
 import tensorflow.keras.backend as K
 from tensorflow.keras.callbacks import Callback, CSVLogger, EarlyStopping, ModelCheckpoint, ReduceLROnPlateau, TensorBoard, TerminateOnNaN
 from tensorflow.keras.layers import Activation, BatchNormalization, Concatenate, Conv1D, Dense, Dropout, Embedding, Flatten, Input, Layer, MaxPooling1D
@@ -17,48 +21,55 @@ class Model:
 
     def build(self, model_config, pretrained_word_embeddings=None):
 
+        # The precision is set per layer rather than with the global policy, so that it is saved with the model and does not leak into later models
+        self._dtype = 'mixed_float16' if model_config.mixed_precision else 'float32'
+
         word_embedding_layer = self._word_embedding_layer(model_config, pretrained_word_embeddings)
         conv_layers = self._create_conv_layers(model_config)
 
         title_input = Input(shape=(model_config.title_max_words,), name='title_input')
         title_word_embeddings = word_embedding_layer(title_input)
-        title_features = self._text_feature_extraction(model_config, conv_layers, title_word_embeddings, 1)
+        title_features = self._text_feature_extraction(model_config, conv_layers, title_word_embeddings, 1, model_config.title_max_words)
         
-        abstract_input = Input(shape=(model_config.abstract_max_words,), name='abstract_input')
+        # Bucketed abstracts are padded to a different length in every batch
+        abstract_length = None if model_config.bucket_abstracts else model_config.abstract_max_words
+        abstract_input = Input(shape=(abstract_length,), name='abstract_input')
         abstract_word_embeddings = word_embedding_layer(abstract_input)
-        abstract_features = self._text_feature_extraction(model_config, conv_layers, abstract_word_embeddings, model_config.num_pool_regions)
+        abstract_features = self._text_feature_extraction(model_config, conv_layers, abstract_word_embeddings, model_config.num_pool_regions, model_config.abstract_max_words)
       
         pub_year_input, pub_year = self._create_time_period_input(model_config.num_pub_year_time_periods, model_config.inputs_dropout_rate, 'pub_year_input')
         year_completed_input, year_completed = self._create_time_period_input(model_config.num_year_completed_time_periods, model_config.inputs_dropout_rate, 'year_completed_input')
 
         #journal_input, journal_embedding = self._journal_embedding(model_config.num_journals, model_config.journal_embedding_size, model_config.inputs_dropout_rate)
         
-        hidden = Concatenate()([title_features, abstract_features, pub_year, year_completed])
+        hidden = Concatenate(dtype=self._dtype)([title_features, abstract_features, pub_year, year_completed])
         for layer_size in model_config.hidden_layer_sizes:
-            hidden = Dense(layer_size, activation=None, use_bias=False)(hidden)
-            hidden = BatchNormalization()(hidden)
-            hidden = Activation(model_config.hidden_layer_act)(hidden)
-            hidden = Dropout(model_config.dropout_rate)(hidden)
+            hidden = Dense(layer_size, activation=None, use_bias=False, dtype=self._dtype)(hidden)
+            hidden = BatchNormalization(dtype=self._dtype)(hidden)
+            hidden = Activation(model_config.hidden_layer_act, dtype=self._dtype)(hidden)
+            hidden = Dropout(model_config.dropout_rate, dtype=self._dtype)(hidden)
 
-        output = Dense(model_config.output_layer_size, activation=model_config.output_layer_act)(hidden)
+        output = Dense(model_config.output_layer_size, activation=model_config.output_layer_act, dtype='float32')(hidden) # float32 for numeric stability under mixed precision
 
         model = tensorflow.keras.models.Model(inputs=[title_input, abstract_input, pub_year_input, year_completed_input], outputs=[output])
 
-        loss, optimizer, metrics, fscore_threshold = self._get_compile_inputs(model_config.init_learning_rate, model_config.init_threshold) 
+        loss, optimizer, metrics, fscore_threshold = self._get_compile_inputs(model_config.init_learning_rate, model_config.init_threshold, model_config.mixed_precision) 
         self._fscore_threshold = fscore_threshold
-        model.compile(loss=loss, optimizer=optimizer, metrics=metrics)
+        # XLA compilation of the training and prediction steps. TF 2.4 has no jit_compile argument, so it is only passed when enabled.
+        jit_compile_kwargs = { 'jit_compile': True } if model_config.jit_compile else {}
+        model.compile(loss=loss, optimizer=optimizer, metrics=metrics, **jit_compile_kwargs)
         self._model = model
 
     def _create_conv_layers(self, model_config):
         conv_layers = []
         for filter_size in model_config.conv_filter_sizes:
-            conv_layer = Conv1D(model_config.conv_num_filters, filter_size, activation=None, padding='valid', strides=1, use_bias=False)
+            conv_layer = Conv1D(model_config.conv_num_filters, filter_size, activation=None, padding='valid', strides=1, use_bias=False, dtype=self._dtype)
             conv_layers.append(conv_layer)
         return conv_layers
 
     def _create_time_period_input(self, num_time_periods, dropout_rate, name):
         time_period_input = Input(shape=(num_time_periods,), name=name)
-        time_period = Dropout(dropout_rate)(time_period_input)
+        time_period = Dropout(dropout_rate, dtype=self._dtype)(time_period_input)
         return time_period_input, time_period
 
     def _journal_embedding(self, num_journals, journal_embedding_size, dropout_rate):
@@ -68,19 +79,23 @@ class Model:
         journal_embedding = Dropout(dropout_rate)(journal_embedding)
         return journal_input, journal_embedding
 
-    def _text_feature_extraction(self, model_config, conv_layers, word_embeddings, num_pool_regions):
+    def _text_feature_extraction(self, model_config, conv_layers, word_embeddings, num_pool_regions, max_words):
         conv_blocks = []
         for conv_layer in conv_layers:
             conv = conv_layer(word_embeddings)
-            conv = BatchNormalization()(conv)
-            conv = Activation(model_config.conv_act)(conv)
-            pool_size = K.int_shape(conv)[1] // num_pool_regions
-            conv = MaxPooling1D(pool_size=pool_size, strides=pool_size, padding='valid')(conv)
-            conv = Flatten()(conv)
+            conv = BatchNormalization(dtype=self._dtype)(conv)
+            conv = Activation(model_config.conv_act, dtype=self._dtype)(conv)
+            if K.int_shape(conv)[1] is None: # Variable length
+                pool_size = (max_words - conv_layer.kernel_size[0] + 1) // num_pool_regions
+                conv = RegionMaxPooling1D(num_pool_regions, pool_size, dtype=self._dtype)(conv)
+            else:
+                pool_size = K.int_shape(conv)[1] // num_pool_regions
+                conv = MaxPooling1D(pool_size=pool_size, strides=pool_size, padding='valid', dtype=self._dtype)(conv)
+                conv = Flatten(dtype=self._dtype)(conv)
             conv_blocks.append(conv)
 
-        concat = Concatenate()(conv_blocks) if len(conv_blocks) > 1 else conv_blocks[0]
-        text_features = Dropout(model_config.dropout_rate)(concat)
+        concat = Concatenate(dtype=self._dtype)(conv_blocks) if len(conv_blocks) > 1 else conv_blocks[0]
+        text_features = Dropout(model_config.dropout_rate, dtype=self._dtype)(concat)
         return text_features
 
     def _word_embedding_layer(self, model_config, pretrained_word_embeddings):
@@ -92,12 +107,12 @@ class Model:
             vocab_size = model_config.vocab_size
             word_embedding_size = model_config.word_embedding_size
         if use_pretrained_word_embeddings:
-            word_embedding_layer = EmbeddingWithDropout(model_config.word_embedding_dropout_rate, vocab_size, word_embedding_size, trainable=True, weights=[pretrained_word_embeddings])
+            word_embedding_layer = EmbeddingWithDropout(model_config.word_embedding_dropout_rate, vocab_size, word_embedding_size, trainable=True, weights=[pretrained_word_embeddings], dtype=self._dtype)
         else:
-            word_embedding_layer = EmbeddingWithDropout(model_config.word_embedding_dropout_rate, vocab_size, word_embedding_size, trainable=True)
+            word_embedding_layer = EmbeddingWithDropout(model_config.word_embedding_dropout_rate, vocab_size, word_embedding_size, trainable=True, dtype=self._dtype)
         return word_embedding_layer
 
-    def fit(self, root_config, training_data, dev_data, opt_data, output_dir):
+    def fit(self, root_config, training_data, dev_data, opt_data, output_dir, steps_per_epoch=None, validation_steps=None):
         train_config = root_config.train
         resume_config = train_config.resume
 
@@ -158,8 +173,8 @@ class Model:
             tensorboard_callback = TensorBoard(log_dir, write_graph=train_config.tensorboard.write_graph)
             callbacks.append(tensorboard_callback)
 
-        history = self._model.fit(training_data, epochs=train_config.max_epochs, verbose=1, callbacks=callbacks, 
-                                 validation_data=dev_data, shuffle=True, initial_epoch=train_config.initial_epoch, use_multiprocessing=train_config.use_multiprocessing, workers=train_config.workers, max_queue_size=train_config.max_queue_size)
+        history = self._model.fit(training_data, epochs=train_config.max_epochs, verbose=1, callbacks=callbacks, steps_per_epoch=steps_per_epoch,
+                                 validation_data=dev_data, validation_steps=validation_steps, shuffle=True, initial_epoch=train_config.initial_epoch, use_multiprocessing=train_config.use_multiprocessing, workers=train_config.workers, max_queue_size=train_config.max_queue_size)
         logs = history.history
 
         monitor_mode_func = globals()['__builtins__'][train_config.monitor_mode]
@@ -177,10 +192,56 @@ class Model:
 
         return best_epoch_logs
 
+    def export(self, root_config, output_dir):
+        """Saves an inference only copy of the model, with the weights of the latest checkpoint."""
+        export_config = root_config.train.export
+        checkpoint_dir = os_path.join(output_dir, root_config.model.checkpoint.dir)
+        checkpoint_paths = glob.glob(os_path.join(checkpoint_dir, '*.hdf5'))
+        if checkpoint_paths: # Checkpoints are only saved when the monitored metric improves
+            self._model.load_weights(max(checkpoint_paths, key=os_path.getmtime))
+
+        inference_model = tensorflow.keras.models.clone_model(self._model, clone_function=self._clone_inference_layer)
+        inference_model.set_weights(self._model.get_weights())
+
+        export_dir = os_path.join(output_dir, export_config.dir)
+        self._mkdir(export_dir)
+        inference_model.save(os_path.join(export_dir, export_config.saved_model_dir), include_optimizer=False, save_format='tf')
+
+        if export_config.tflite:
+            converter = tf.lite.TFLiteConverter.from_keras_model(inference_model)
+            with open(os_path.join(export_dir, export_config.tflite_filename), 'wb') as tflite_file:
+                tflite_file.write(converter.convert())
+
+        if export_config.onnx:
+            try:
+                import tf2onnx
+            except ImportError:
+                print('tf2onnx is not installed, skipping the ONNX export.')
+            else:
+                tf2onnx.convert.from_keras(inference_model, opset=export_config.onnx_opset, output_path=os_path.join(export_dir, export_config.onnx_filename))
+
+        return inference_model
+
+    def _clone_inference_layer(self, layer):
+        # Dropout is the identity at inference time and the exported model is always float32
+        config = layer.get_config()
+        config['dtype'] = 'float32'
+        if isinstance(layer, EmbeddingWithDropout):
+            del config['dropout_rate']
+            return Embedding.from_config(config)
+        if isinstance(layer, Dropout):
+            return Activation('linear', name=layer.name, dtype='float32')
+        return layer.__class__.from_config(config)
+
+    @property
+    def variable_length_abstracts(self):
+        """True for a model built for bucketed abstracts, which must be given bucketed batches."""
+        return K.int_shape(self._model.get_layer('abstract_input').output)[1] is None
+
     def restore(self, restore_config, input_dir):
         checkpoint_path = os_path.join(input_dir, restore_config.model_checkpoint_dir, restore_config.model_checkpoint_filename)
         loss, optimizer, metrics, _ = self._get_compile_inputs(restore_config.learning_rate, restore_config.threshold) 
-        custom_objects = { EmbeddingWithDropout.__name__: EmbeddingWithDropout }
+        custom_objects = { EmbeddingWithDropout.__name__: EmbeddingWithDropout, RegionMaxPooling1D.__name__: RegionMaxPooling1D }
         if restore_config.weights_only_checkpoint:
             model_json_filepath = os_path.join(input_dir, restore_config.model_json_filename)
             with open(model_json_filepath, 'rt', encoding=restore_config.encoding) as model_json_file:
@@ -194,24 +255,85 @@ class Model:
             custom_objects[loss.__name__] = loss
             self._model = tensorflow.keras.models.load_model(checkpoint_path, custom_objects=custom_objects)
 
+    def warm_start(self, root_config, previous_runs_dir, previous_word_index_lookup, word_index_lookup):
+        """Initializes the built model with the weights of the latest checkpoint of a previous run."""
+        save_config = root_config.train.save_config
+        checkpoint_paths = glob.glob(os_path.join(previous_runs_dir, root_config.model.checkpoint.dir, '*.hdf5'))
+        if not checkpoint_paths:
+            raise FileNotFoundError(f'No checkpoint found in {previous_runs_dir}')
+        custom_objects = { EmbeddingWithDropout.__name__: EmbeddingWithDropout, RegionMaxPooling1D.__name__: RegionMaxPooling1D }
+        with open(os_path.join(previous_runs_dir, save_config.model_json_filename), 'rt', encoding=save_config.encoding) as model_json_file:
+            previous_model = tensorflow.keras.models.model_from_json(model_json_file.read(), custom_objects=custom_objects)
+        previous_model.load_weights(max(checkpoint_paths, key=os_path.getmtime))
+
+        time_period_sizes = self._get_time_period_sizes(self._model)
+        previous_time_period_sizes = self._get_time_period_sizes(previous_model)
+        for layer, previous_layer in zip(self._model.layers, previous_model.layers):
+            weights, previous_weights = layer.get_weights(), previous_layer.get_weights()
+            if not weights and not previous_weights:
+                continue
+            if type(layer) is not type(previous_layer) or len(weights) != len(previous_weights):
+                raise ValueError(f'Layer {layer.name} does not match layer {previous_layer.name} of the previous model')
+            if isinstance(layer, EmbeddingWithDropout):
+                weights = [self._remap_word_embeddings(previous_weights[0], weights[0], previous_word_index_lookup, word_index_lookup)]
+            elif isinstance(layer, Dense) and weights[0].shape != previous_weights[0].shape:
+                # The number of time periods changes when the year range moves
+                weights = [self._remap_time_period_rows(previous_weights[0], weights[0], previous_time_period_sizes, time_period_sizes)] + previous_weights[1:]
+            elif any(weight.shape != previous_weight.shape for weight, previous_weight in zip(weights, previous_weights)):
+                raise ValueError(f'The weights of layer {layer.name} do not match the previous model')
+            else:
+                weights = previous_weights
+            layer.set_weights(weights)
+
+    def _get_time_period_sizes(self, model):
+        return [K.int_shape(model.get_layer(name).output)[1] for name in ['pub_year_input', 'year_completed_input']]
+
+    def _remap_time_period_rows(self, previous_kernel, kernel, previous_time_period_sizes, time_period_sizes):
+        # The kernel rows are the text and journal features, followed by the time period inputs.
+        # Time periods are counted back from the most recent one, so they are aligned at the end.
+        num_feature_rows = kernel.shape[0] - sum(time_period_sizes)
+        if previous_kernel.shape[0] - sum(previous_time_period_sizes) != num_feature_rows or previous_kernel.shape[1:] != kernel.shape[1:]:
+            raise ValueError('The hidden layer does not match the previous model')
+        kernel = kernel.copy()
+        kernel[:num_feature_rows] = previous_kernel[:num_feature_rows]
+        start, previous_start = num_feature_rows, num_feature_rows
+        for size, previous_size in zip(time_period_sizes, previous_time_period_sizes):
+            num_shared = min(size, previous_size)
+            kernel[start + size - num_shared:start + size] = previous_kernel[previous_start + previous_size - num_shared:previous_start + previous_size]
+            start += size
+            previous_start += previous_size
+        return kernel
+
+    def _remap_word_embeddings(self, previous_embeddings, embeddings, previous_word_index_lookup, word_index_lookup):
+        # Words in both vocabularies keep their previous embedding, new words keep their initialization
+        previous_vocab_size, vocab_size = len(previous_embeddings), len(embeddings)
+        embeddings = embeddings.copy()
+        embeddings[:2] = previous_embeddings[:2] # Padding and unknown word
+        index_pairs = [(index, previous_word_index_lookup[word]) for word, index in word_index_lookup.items()
+                       if index < vocab_size and previous_word_index_lookup.get(word, previous_vocab_size) < previous_vocab_size]
+        if index_pairs:
+            indices, previous_indices = np.array(index_pairs).T
+            embeddings[indices] = previous_embeddings[previous_indices]
+        print(f'Warm start: {len(index_pairs)} of {vocab_size - 2} word embeddings copied from the previous model')
+        return embeddings
+
     def predict(self, pred_config, test_data):
-        predictions = {}
-        num_batches = len(test_data)
-        for batch_index in range(num_batches):
-            x = test_data[batch_index][0]
-            y = test_data[batch_index][1]
-            batch_scores = self._model.predict_on_batch(x)
-            batch_size = len(batch_scores)
-            for index in range(batch_size):
-                pmid = int(x['pmids'][index])
-                score = batch_scores[index][0]
-                act = y[index][0]
-                predictions[pmid] = { 'act': act, 'score': score}
+        pmids, labels, scores = self.predict_arrays(pred_config, test_data)
+        predictions = { pmid: { 'act': act, 'score': score } for pmid, act, score in zip(pmids.tolist(), labels, scores) }
         return predictions
 
-    def _get_compile_inputs(self, learning_rate, threshold):
+    def predict_arrays(self, pred_config, test_data):
+        scores = self._model.predict(test_data, use_multiprocessing=pred_config.use_multiprocessing, workers=pred_config.workers, max_queue_size=pred_config.max_queue_size)
+        pmids = test_data.pmids.reshape(-1)
+        labels = test_data.labels.reshape(-1)
+        scores = scores[:, 0]
+        return pmids, labels, scores
+
+    def _get_compile_inputs(self, learning_rate, threshold, loss_scaling=False):
         loss = binary_crossentropy
         optimizer = Adam(lr=learning_rate)
+        if loss_scaling:
+            optimizer = mixed_precision.LossScaleOptimizer(optimizer)
         fscore_metric = F1Score(None, 'micro', threshold, name=FSCORE_METRIC_NAME)
         metrics = [fscore_metric]
         return loss, optimizer, metrics, fscore_metric.threshold 
@@ -226,47 +348,66 @@ class Model:
 
 
 class OptimizeFscoreThresholdCallback(Callback):
+    """Tunes the fscore threshold on the optimization set at the end of every epoch.
+
+    The optimization set is predicted once and the fscore of every candidate threshold
+    is computed from the cached scores. The candidates are either the 2k+1 grid
+    points around the current threshold or, for the exact search, every distinct score.
+    """
 
     def __init__(self, threshold, config, opt_data):
         super().__init__()
         self.config = config
         self.opt_data = opt_data
         self.threshold = threshold
-        self.metric_index = -1
 
     def set_model(self, model):
         super().set_model(model)
         
     def on_batch_end(self, batch, logs = None):
 
-        if self.metric_index < 0:
-            for idx, metric_name in enumerate(self.model.metrics_names):
-                if metric_name == self.config.metric_name:
-                    self.metric_index = idx
-
         step = batch + 1
         if step == self.params['steps']: # Have finished the last batch
             self.prev_threshold_value = K.get_value(self.threshold)
-            alpha = self.config.alpha
-            k = self.config.k
-            candidate_thresholds = [(self.prev_threshold_value - (alpha*k)) + (x*alpha) for x in range(2*k + 1)]
-            best_metric_value = 0
-            best_threshold = self.prev_threshold_value
-            for candidate_threshold in candidate_thresholds:
-                K.set_value(self.threshold, candidate_threshold)
-                metrics = self.model.evaluate(self.opt_data, use_multiprocessing=self.config.use_multiprocessing, workers=self.config.workers, max_queue_size=self.config.max_queue_size)
-                metric_value = metrics[self.metric_index]
-                if metric_value > best_metric_value:
-                    best_metric_value = metric_value
-                    best_threshold = candidate_threshold
+            scores = self.model.predict(self.opt_data, use_multiprocessing=self.config.use_multiprocessing, workers=self.config.workers, max_queue_size=self.config.max_queue_size)
+            y_score = np.asarray(scores, dtype=np.float32).reshape(-1)
+            y_true = np.asarray(self.opt_data.labels, dtype=np.float32).reshape(-1)
+            candidate_thresholds = self._get_candidate_thresholds(y_score)
+            fscores = self._compute_fscores(y_true, y_score, candidate_thresholds)
+            best_index = np.argmax(fscores)
+            best_threshold = float(candidate_thresholds[best_index]) if fscores[best_index] > 0 else self.prev_threshold_value
             K.set_value(self.threshold, best_threshold)
             
-
     def on_epoch_end(self, epoch, logs = None):
         logs = logs or {}
         logs['threshold'] = self.prev_threshold_value
         logs['val_threshold'] = K.get_value(self.threshold)
 
+    def _compute_fscores(self, y_true, y_score, thresholds):
+        # An article is predicted positive if its score is > threshold, as in the fscore metric
+        order = np.argsort(y_score, kind='mergesort')
+        sorted_scores = y_score[order]
+        cum_true = np.concatenate([[0.], np.cumsum(y_true[order], dtype=np.float64)])
+        num_not_predicted = np.searchsorted(sorted_scores, thresholds, side='right')
+        num_actual = cum_true[-1]
+        true_positives = num_actual - cum_true[num_not_predicted]
+        num_predicted = len(y_score) - num_not_predicted
+        # F1 = 2TP / (2TP + FP + FN) = 2TP / (predicted + actual)
+        denominator = num_predicted + num_actual
+        fscores = np.divide(2*true_positives, denominator, out=np.zeros(len(thresholds)), where=denominator > 0)
+        return fscores
+
+    def _get_candidate_thresholds(self, y_score):
+        if self.config.search == 'exact':
+            candidate_thresholds = np.unique(np.append(y_score, np.float32(self.prev_threshold_value)))
+        elif self.config.search == 'grid':
+            alpha = self.config.alpha
+            k = self.config.k
+            candidate_thresholds = np.array([(self.prev_threshold_value - (alpha*k)) + (x*alpha) for x in range(2*k + 1)], dtype=np.float32)
+        else:
+            raise ValueError(f'Unknown threshold search: {self.config.search}')
+        return candidate_thresholds
+
 
 class EmbeddingWithDropout(Embedding):
 
@@ -274,14 +415,63 @@ class EmbeddingWithDropout(Embedding):
         self.dropout_rate = dropout_rate
         super().__init__(*args, **kwargs)
 
-    def call(self, inputs):
+    def call(self, inputs, training=None):
         if K.dtype(inputs) != 'int32':
             inputs = K.cast(inputs, 'int32')
-        _embeddings = K.in_train_phase(K.dropout(self.embeddings, self.dropout_rate, noise_shape=[self.input_dim,1]), self.embeddings) if self.dropout_rate > 0 else self.embeddings
-        out = K.gather(_embeddings, inputs)
+        out = K.gather(self.embeddings, inputs)
+        if self.dropout_rate > 0:
+            out = K.in_train_phase(lambda: self._drop_rows(inputs, out), out, training=training)
+        if self._compute_dtype != self.dtype: # Mixed precision
+            out = K.cast(out, self._compute_dtype)
         return out
 
+    def _drop_rows(self, inputs, embeddings):
+        # Same as dropout on the whole embedding matrix with noise_shape [input_dim, 1], but the mask is only 
+        # drawn for the rows that are looked up. Every occurrence of a word shares the mask of its row.
+        unique_ids, unique_indices = tf.unique(K.flatten(inputs))
+        keep_prob = 1. - self.dropout_rate
+        row_scales = K.cast(tf.random.uniform(tf.shape(unique_ids)) >= self.dropout_rate, embeddings.dtype) / keep_prob
+        scales = K.reshape(K.gather(row_scales, unique_indices), tf.concat([tf.shape(inputs), [1]], axis=0))
+        return embeddings * scales
+
     def get_config(self):
         config = { 'dropout_rate': self.dropout_rate }
         base_config = super().get_config()
-        return dict(list(base_config.items()) + list(config.items()))
\ No newline at end of file
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+class RegionMaxPooling1D(Layer):
+    """Max pooling over num_regions fixed regions of region_size steps, flattened.
+
+    Equivalent to MaxPooling1D(region_size, region_size) followed by Flatten for inputs
+    of the full length, but also accepts shorter inputs: missing steps are ignored and
+    a region without any steps pools to 0. A bucketed batch is only padded to its longest
+    abstract, so a model trained on bucketed batches does not see the padding a fixed
+    length batch has, and gives different scores for fixed length batches. Such models
+    are predicted with bucketed batches too (see Model.variable_length_abstracts).
+    """
+
+    def __init__(self, num_regions, region_size, **kwargs):
+        self.num_regions = num_regions
+        self.region_size = region_size
+        super().__init__(**kwargs)
+
+    def call(self, inputs):
+        num_channels = K.int_shape(inputs)[-1]
+        pooled_length = self.num_regions*self.region_size
+        inputs = inputs[:, :pooled_length]
+        padding = tf.maximum(pooled_length - tf.shape(inputs)[1], 0)
+        inputs = tf.pad(inputs, [[0, 0], [0, padding], [0, 0]], constant_values=inputs.dtype.min)
+        regions = K.reshape(inputs, (-1, self.num_regions, self.region_size, num_channels))
+        out = K.max(regions, axis=2)
+        out = tf.where(out == inputs.dtype.min, tf.zeros_like(out), out)
+        out = K.reshape(out, (-1, self.num_regions*num_channels))
+        return out
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0], self.num_regions*input_shape[-1])
+
+    def get_config(self):
+        config = { 'num_regions': self.num_regions, 'region_size': self.region_size }
+        base_config = super().get_config()
+        return dict(list(base_config.items()) + list(config.items()))
@@ -3,7 +3,7 @@ from .model import Model
 from .settings import get_config
 
 
-def run(data_dir, runs_dir, word_index_lookup, journal_id_lookup, test_set, preprocessing_config):
+def run(data_dir, runs_dir, word_index_lookup, journal_id_lookup, test_set, preprocessing_config, test_token_cache=None):
     
     config = get_config(data_dir=data_dir, runs_dir=runs_dir)
 
@@ -17,10 +17,12 @@ def run(data_dir, runs_dir, word_index_lookup, journal_id_lookup, test_set, prep
     pp_config.max_year_completed = preprocessing_config["max_year_indexed"]
     pp_config.date_format = preprocessing_config["date_format"]
 
-    word_index_lookup = set_vocab_size(word_index_lookup, pp_config.vocab_size)
-    test_gen = DataGenerator(pp_config, word_index_lookup, journal_id_lookup, test_set, pred_config.batch_size, pred_config.limit)
-
     model = Model()
     model.restore(pred_config, input_dir)
-    predictions = model.predict(pred_config, test_gen)
-    return predictions
\ No newline at end of file
+    # The abstracts are padded as in training, so that the pooled features are the same
+    pp_config.bucket_abstracts = model.variable_length_abstracts
+
+    word_index_lookup = set_vocab_size(word_index_lookup, pp_config.vocab_size)
+    test_gen = DataGenerator(pp_config, word_index_lookup, journal_id_lookup, test_set, pred_config.batch_size, pred_config.limit, token_cache=test_token_cache)
+    pmids, labels, scores = model.predict_arrays(pred_config, test_gen)
+    return pmids, labels, scores
\ No newline at end of file
@@ -69,6 +69,15 @@ class _CsvLoggerConfig(_ConfigBase):
         self.encoding = ENCODING
 
 
+class _DistributeConfig(_ConfigBase):
+    def _initialize(self, _):
+
+        self.strategy = None # None, 'mirrored' or 'multi_worker_mirrored' (one process per worker, cluster set in TF_CONFIG)
+        self.num_cpu_replicas = 0 # mirrored only: > 0 splits the CPU into this many logical devices, one replica each
+        self.scale_batch_size = True # True: batch_size is per replica
+        self.non_chief_dir = 'workers' # non-chief workers write their checkpoints and logs to <root_dir>/workers/<worker index>
+
+
 class _EarlyStoppingConfig(_ConfigBase):
     def _initialize(self, _):
 
@@ -106,6 +115,9 @@ class _ModelConfig(_ConfigBase):
         self.init_threshold = 0.5
         self.init_learning_rate = 0.001
 
+        self.mixed_precision = False # mixed_float16 policy with loss scaling
+        self.jit_compile = False # Model.compile(jit_compile=True), requires TF 2.6 or later
+
     @property
     def hidden_layer_sizes(self):
         return [self.hidden_layer_size]*self.num_hidden_layers
@@ -136,6 +148,10 @@ class _ModelConfig(_ConfigBase):
     def abstract_max_words(self):
         return self._pp_config.abstract_max_words
 
+    @property
+    def bucket_abstracts(self):
+        return self._pp_config.bucket_abstracts
+
     @property
     def num_year_completed_time_periods(self):
         return self._pp_config.num_year_completed_time_periods
@@ -160,6 +176,10 @@ class _PreprocessingConfig(_ConfigBase):
         self.max_pub_year = None # 2018
         self.date_format = '%Y-%m-%d'
         self.time_period_size = 5
+        self.bucket_abstracts = False # Batch abstracts of similar length, padded to the longest in the batch
+        self.abstract_bucket_granularity = 32
+        self.abstract_bucket_min_words = 32 # Must be at least the largest conv filter size
+        self.abstract_bucket_seed = 0 # The same for all workers, so that they shuffle the buckets alike
 
     def _num_time_periods(self, min_year, max_year):
         if min_year is None:
@@ -236,6 +256,26 @@ class _SaveConfig(_ConfigBase):
         self.model_img_filename = 'model.png'
 
 
+class _TfDataConfig(_ConfigBase):
+    def _initialize(self, _):
+
+        self.num_parallel_calls = -1 # tf.data.experimental.AUTOTUNE
+        self.prefetch_buffer_size = -1 # tf.data.experimental.AUTOTUNE
+        self.shuffle_buffer_size = 0 # 0 = all batches
+        self.cache = False
+        self.cache_filename = '' # '' = in memory
+
+
+class _WarmStartConfig(_ConfigBase):
+    def _initialize(self, _):
+
+        # Fine-tuning schedule used instead of the training defaults when starting from the previous release's model
+        self.learning_rate = 0.0003
+        self.max_epochs = 10
+        self.early_stopping_min_delta = 0.0005
+        self.early_stopping_patience = 1
+
+
 class _TensorboardConfig(_ConfigBase):
     def _initialize(self, _):
 
@@ -244,6 +284,19 @@ class _TensorboardConfig(_ConfigBase):
         self.write_graph = True
 
 
+class _ExportConfig(_ConfigBase):
+    def _initialize(self, _):
+
+        self.enabled = False # Inference only copy of the best checkpoint, without dropout or optimizer
+        self.dir = 'export'
+        self.saved_model_dir = 'saved_model'
+        self.tflite = False
+        self.tflite_filename = 'model.tflite'
+        self.onnx = False # Requires tf2onnx
+        self.onnx_filename = 'model.onnx'
+        self.onnx_opset = 13
+
+
 class _InputsConfig(_ConfigBase):
     def _initialize(self, machine_config):
 
@@ -258,6 +311,7 @@ class _OptimizeFscoreThresholdConfig(_ProcessingConfig):
         self.batch_size = 128
         self.limit = 1000000000
         self.metric_name = 'fscore'
+        self.search = 'grid' # 'grid' or 'exact'
         self.alpha = 0.005
         self.k = 3
 
@@ -273,6 +327,9 @@ class _TrainingConfig(_ProcessingConfig):
         self.dev_limit = 1000000000
         self.monitor_metric = 'val_fscore'
         self.monitor_mode = 'max'
+        self.input_pipeline = 'sequence' # 'sequence' or 'tf_data'
+        self.tf_data = _TfDataConfig(self, machine_config)
+        self.distribute = _DistributeConfig(self, machine_config)
         self.save_config = _SaveConfig(self, machine_config)
         self.optimize_fscore_threshold = _OptimizeFscoreThresholdConfig(self, machine_config)
         self.reduce_learning_rate = _ReduceLearningRateConfig(self, machine_config)
@@ -280,6 +337,8 @@ class _TrainingConfig(_ProcessingConfig):
         self.tensorboard = _TensorboardConfig(self, machine_config)
         self.csv_logger = _CsvLoggerConfig(self, machine_config)
         self.resume = _ResumeConfig(self, machine_config)
+        self.warm_start = _WarmStartConfig(self, machine_config)
+        self.export = _ExportConfig(self, machine_config)
 
 
 class Config(_ConfigBase):
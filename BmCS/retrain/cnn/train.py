@@ -1,9 +1,11 @@
 from .data_helper import DataGenerator, set_vocab_size
+from .distribute_helper import create_distributed_dataset, create_strategy, get_worker_info
 from .model import Model
+import os
 from .settings import get_config
 
 
-def run(data_dir, runs_dir, word_index_lookup, journal_id_lookup, train_set, dev_set, preprocessing_config):
+def run(data_dir, runs_dir, word_index_lookup, journal_id_lookup, train_set, dev_set, preprocessing_config, train_token_cache=None, dev_token_cache=None, previous_runs_dir=None, previous_word_index_lookup=None):
     
     config = get_config(data_dir=data_dir, runs_dir=runs_dir)
 
@@ -20,11 +22,47 @@ def run(data_dir, runs_dir, word_index_lookup, journal_id_lookup, train_set, dev
     pp_config.max_year_completed = preprocessing_config["max_year_indexed"]
     pp_config.date_format = preprocessing_config["date_format"]
 
+    # Fine-tune the previous release's model with its own schedule
+    warm_start = previous_runs_dir is not None
+    if warm_start:
+        warm_start_config = config.train.warm_start
+        model_config.init_learning_rate = warm_start_config.learning_rate
+        config.train.max_epochs = warm_start_config.max_epochs
+        config.train.early_stopping.min_delta = warm_start_config.early_stopping_min_delta
+        config.train.early_stopping.patience = warm_start_config.early_stopping_patience
+
+    # The generators make per replica batches, so a global step is batch_size*num_replicas_in_sync articles
+    distribute_config = config.train.distribute
+    strategy = create_strategy(distribute_config)
+    _, worker_index = get_worker_info(strategy)
+    num_replicas = strategy.num_replicas_in_sync if strategy is not None else 1
+    batch_size = config.train.batch_size if distribute_config.scale_batch_size else max(config.train.batch_size // num_replicas, 1)
+    if worker_index > 0: # Non-chief
+        output_dir = os.path.join(output_dir, distribute_config.non_chief_dir, str(worker_index))
+        os.makedirs(output_dir, exist_ok=True)
+
     word_index_lookup = set_vocab_size(word_index_lookup, pp_config.vocab_size)
-    train_gen = DataGenerator(pp_config, word_index_lookup, journal_id_lookup, train_set, config.train.batch_size, config.train.train_limit)
-    dev_gen =   DataGenerator(pp_config, word_index_lookup, journal_id_lookup, dev_set, config.train.batch_size, config.train.dev_limit)
-    opt_gen =   DataGenerator(pp_config, word_index_lookup, journal_id_lookup, dev_set, ofs_config.batch_size, ofs_config.limit)
+    train_gen = DataGenerator(pp_config, word_index_lookup, journal_id_lookup, train_set, batch_size, config.train.train_limit, token_cache=train_token_cache, shuffle=True)
+    dev_gen =   DataGenerator(pp_config, word_index_lookup, journal_id_lookup, dev_set, batch_size, config.train.dev_limit, token_cache=dev_token_cache)
+    opt_gen =   DataGenerator(pp_config, word_index_lookup, journal_id_lookup, dev_set, ofs_config.batch_size, ofs_config.limit, token_cache=dev_token_cache)
+
+    if config.train.input_pipeline == 'tf_data' or strategy is not None: # Distributed training always uses tf.data
+        train_data, train_steps = create_distributed_dataset(strategy, train_gen, config.train.tf_data, True)
+        dev_data, dev_steps = create_distributed_dataset(strategy, dev_gen, config.train.tf_data, False)
+    elif config.train.input_pipeline == 'sequence':
+        train_data, train_steps = train_gen, None
+        dev_data, dev_steps = dev_gen, None
+    else:
+        raise ValueError(f'Unknown input pipeline: {config.train.input_pipeline}')
 
     model = Model()
-    model.build(model_config)
-    model.fit(config, train_gen, dev_gen, opt_gen, output_dir)
\ No newline at end of file
+    if strategy is not None:
+        with strategy.scope():
+            model.build(model_config)
+    else:
+        model.build(model_config)
+    if warm_start:
+        model.warm_start(config, previous_runs_dir, previous_word_index_lookup, word_index_lookup)
+    model.fit(config, train_data, dev_data, opt_gen, output_dir, train_steps, dev_steps)
+    if config.train.export.enabled:
+        model.export(config, output_dir)
\ No newline at end of file
@@ -4,23 +4,31 @@ from datetime import date
 BASELINE_FILENAME_TEMPLATE = "pubmed23n{0:04d}.xml.gz"
 BASELINE_URL = "https://ftp.ncbi.nlm.nih.gov/pubmed/baseline/" # Must include last /
 BMCS_RESULTS_FILENAME = "selective-type-dump_15th_Nov_22.txt.gz"
+CNN_WARM_START_REPLAY_FRACTION = 0.1 # Fraction of the articles the previous CNN was trained on that are replayed when warm starting
+CNN_WARM_START_WORKDIR = None # Working directory of the previous release. If set, the CNN is fine-tuned from the previous model on the new articles.
+DATASET_FORMAT = "columnar" # "columnar" (memory mapped NumPy arrays) or "json" (gzipped JSON, as written by earlier releases)
+DOWNLOAD_WORKERS = 8 # Number of concurrent baseline downloads
 EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
 ESEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
 EUTILS_DELAY = 0.34 # seconds
 EUTILS_RETMAX = 10000
+FEATURE_CACHE_MAX_SIZE = 20*2**30 # Bytes of TF-IDF features cached in the working directory, 0 disables the cache
 JOURNAL_MEDLINE_FILENAME = "J_Medline_7th_Nov_22.txt.gz"
 MAX_PROCESSED_DATE = date(2021, 12, 7) # Susan Schmidt: for the majority of the selective journals, the effective date when they were no longer manually selected was 12.08.2021
 NUM_BASLINE_FILES = 1166
+PRECOMPUTE_DATES = True # Store date ordinals and the year completed on dataset articles, so they are not parsed again downstream
 PROBLEMATIC_JOURNALS_FILENAME = "problematic_journals.csv"
 SELECTIVE_INDEXING_PERIODS_FILENAME = "2022_selective_indexing_periods_input.csv"
 SELECTIVELY_INDEXED_JOURNALS_FILENAME = "selectively_indexed_journals_21st_Dec_22.json"
-TEST_SET_FILENAME = "test_set.json.gz"
+TEST_SET_NAME = "test_set"
 TEST_SET_SIZE = 15000
 TEST_SET_YEAR = 2021
+TRAIN_STREAMING_VOTING_MODEL = False # Also train the out-of-core voting model, and compare it with the in memory ensemble on the validation set
 USE_EUTILS = False # Potential issue that eutils can only download 10k records at a time. Also, no error handing has been implemented for eutils services.
 USE_EXISTING_VAL_TEST_SETS = False
-VAL_SET_FILENAME = "validation_set.json.gz"
+VAL_SET_NAME = "validation_set"
 VAL_SET_SIZE = 15000
+VOTING_N_JOBS = -1 # Number of cores used to train the voting model, -1 for all
 
 
 # System settings
@@ -28,9 +36,13 @@ BMCS_RESULTS_DATE_FORMAT = "%Y/%m/%d"
 BMCS_UNCERTAIN_RESULT = 2
 CNN_DATA_DIR = "cnn_model"
 DATE_FORMAT = "%Y-%m-%d"
+DOWNLOAD_MAX_RETRIES = 3
+DOWNLOAD_RETRY_BACKOFF = 2 # seconds before the first retry, doubled for each further retry
+DOWNLOAD_TIMEOUT = 60 # seconds
 DOWNLOADED_DATA_FILENAME_TEMPLATE = "pubmed23n{0:04d}.xml.gz"
 ENCODING = "utf8"
-EXTRACTED_DATA_FILENAME_TEMPLATE = "{0:04d}.json.gz"
+EXTRACTED_DATA_NAME_TEMPLATE = "{0:04d}"
+FEATURE_CACHE_DIR = "feature_cache"
 EXCLUDED_REF_TYPES = ["CommentOn",
 "ErratumFor",
 "ExpressionOfConcernFor",
@@ -42,18 +54,27 @@ EXCLUDED_REF_TYPES = ["CommentOn",
 JOURNAL_ID_DICT_FILENAME = "journal_id_dict.pkl"
 JOURNAL_ID_TXT_FILENAME = "journal_ids.txt"
 MEDLINE_DATA_DIR = "medline_data"
-OPT_THRESHOLDS_DELTA = .00005
+OPT_THRESHOLDS_CURVE_FILENAME_TEMPLATE = "{}_precision_recall_curve.csv"
 OPT_THRESHOLDS_FILENAME_TEMPLATE = "{}_optimum_thresholds.txt"
 OPT_THRESHOLDS_TARGET_PRECISION = 0.988 # 0.97 # These targets have been updated to match the measured precision/recall of BmCS v1 on an updated 2018 test set with a real-world distribution of articles.
 OPT_THRESHOLDS_TARGET_RECALL = 0.983 # 0.995
-TRAIN_SET_FILENAME = "train_set.json.gz"
+STREAMING_VOTING_CHUNK_SIZE = 10000
+STREAMING_VOTING_EPOCHS = 5
+STREAMING_VOTING_MODEL_FILENAME = "streaming_voting_model.joblib"
+STREAMING_VOTING_N_FEATURES = 2**18 # Hashed features per column, which bounds the size of the model
+STREAMING_VOTING_REPORT_FILENAME = "streaming_voting_comparison.txt"
+TOKEN_CACHE_EXTENSION = ".tokens"
+TRAIN_SET_NAME = "train_set"
+VOTING_COMPACT_MODEL_DIR = "compact" # Fast loading copy of the voting model, see BmCS/compact_voting_model.py
 VOTING_DATA_DIR = "voting_model"
+VOTING_PREDICTION_CHUNK_SIZE = 10000
 VOTING_MODEL_FILENAME = "voting_model.joblib"
 WORD_INDEX_DICT_FILENAME = "word_index_dict.pkl"
 WORD_INDEX_TXT_FILENAME = "word_indices.txt"
 WORD_INDEX_TXT_VOCAB_SIZE = 400000
 
 VOTING_TRAIN_YEARS = [2021, 2020, 2019, 2018, 2017]
+STREAMING_VOTING_TRAIN_YEARS = [] # All years
 
 PP_CONFIG = { "min_pub_year": 1809, 
               "max_pub_year": TEST_SET_YEAR, 
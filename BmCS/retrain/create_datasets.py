@@ -1,43 +1,99 @@
 from . import config as cfg
 import csv
-from datetime import datetime as dt
-from .helper import load_dataset, load_indexing_periods, parse_date
+from .dataset_storage import get_dataset_filepath, iter_dataset, load_dataset, save_dataset
+from .helper import add_precomputed_dates, get_date_ordinal, IndexingPeriodIndex, load_indexing_periods, parse_date, parse_year
 import json
 import gzip
 import os.path
 import random
 
 
-def add_bmcs_processing_data(data_set, bmcs_data_lookup):
-    for article in data_set:
-        pmid = article["pmid"]
-        if pmid in bmcs_data_lookup:
-            article_bmcs_data = bmcs_data_lookup[pmid]
-            article["bmcs_processed_date"] = article_bmcs_data["bmcs_processed_date"]
-            article["bmcs_result"] = article_bmcs_data["bmcs_result"]
-        else:
-            article["bmcs_processed_date"] = None
-            article["bmcs_result"] =  None
-
-
-def create_dataset(workdir, num_xml_files):
-    DATA_FILEPATH_TEMPLATE = os.path.join(workdir, cfg.MEDLINE_DATA_DIR, cfg.EXTRACTED_DATA_FILENAME_TEMPLATE)
+MAX_PROCESSED_DATE_ORDINAL = cfg.MAX_PROCESSED_DATE.toordinal()
+
+class FilterPipeline:
+    """Chain of article filters that is evaluated once per article.
+
+    Each filter is a (description, predicate) pair, where the predicate returns
+    True for articles that should be kept. The pipeline counts the articles
+    dropped by each filter, so the dataset size after every stage can be reported
+    without materializing an intermediate list per stage.
+    """
+
+    def __init__(self, filters):
+        self._filters = filters
+        self._num_articles = 0
+        self._drop_counts = [0]*len(filters)
+
+    def filter(self, articles):
+        for article in articles:
+            failed_filter_index = self.get_failed_filter_index(article)
+            self.record(failed_filter_index)
+            if failed_filter_index is None:
+                yield article
+
+    def get_failed_filter_index(self, article):
+        for idx, (_, predicate) in enumerate(self._filters):
+            if not predicate(article):
+                return idx
+        return None
+
+    def print_report(self, initial_description=None):
+        size = self._num_articles
+        if initial_description:
+            print(f"{initial_description}: {size}")
+        for (description, _), drop_count in zip(self._filters, self._drop_counts):
+            size -= drop_count
+            print(f"{description}: {size}")
+
+    def record(self, failed_filter_index):
+        self._num_articles += 1
+        if failed_filter_index is not None:
+            self._drop_counts[failed_filter_index] += 1
+
+
+def add_bmcs_processing_data(article, bmcs_data_lookup):
+    pmid = article["pmid"]
+    if pmid in bmcs_data_lookup:
+        article_bmcs_data = bmcs_data_lookup[pmid]
+        article["bmcs_processed_date"] = article_bmcs_data["bmcs_processed_date"]
+        article["bmcs_result"] = article_bmcs_data["bmcs_result"]
+    else:
+        article["bmcs_processed_date"] = None
+        article["bmcs_result"] =  None
+
+
+def create_dataset(workdir, num_xml_files, filter_pipeline, bmcs_data_lookup):
+    DATA_DIR = os.path.join(workdir, cfg.MEDLINE_DATA_DIR)
     SELECTIVE_INDEXING_PERIODS_FILEPATH = os.path.join(workdir, cfg.SELECTIVE_INDEXING_PERIODS_FILENAME)
 
-    data_set = {}
-    indexing_periods = load_indexing_periods(SELECTIVE_INDEXING_PERIODS_FILEPATH, cfg.ENCODING, False)
+    # A pmid may occur in more than one file, in which case the last occurrence wins. Filtering is 
+    # done while the files are read, so only the index of the first failed filter is kept for dropped articles. 
+    entries = {}
+    indexing_period_index = IndexingPeriodIndex(load_indexing_periods(SELECTIVE_INDEXING_PERIODS_FILEPATH, cfg.ENCODING, False))
     for file_num in range(1, num_xml_files + 1):
         print(f"{file_num}/{num_xml_files}", end="\r")
-        data_filepath = DATA_FILEPATH_TEMPLATE.format(file_num)
-        with gzip.open(data_filepath, "rt", encoding=cfg.ENCODING) as data_file: 
-            data = json.load(data_file)
-            for article in data["articles"]:
-                if is_selectively_indexed(indexing_periods, article):
-                    pmid = article["pmid"]
-                    data_set[pmid] = article
+        data_filepath = get_dataset_filepath(DATA_DIR, cfg.EXTRACTED_DATA_NAME_TEMPLATE.format(file_num))
+        for article in iter_dataset(data_filepath):
+            if is_selectively_indexed(indexing_period_index, article):
+                pmid = article["pmid"]
+                failed_filter_index = filter_pipeline.get_failed_filter_index(article)
+                if failed_filter_index is None:
+                    add_bmcs_processing_data(article, bmcs_data_lookup)
+                    if cfg.PRECOMPUTE_DATES:
+                        add_precomputed_dates(article, cfg.DATE_FORMAT)
+                    entries[pmid] = article
+                else:
+                    entries[pmid] = failed_filter_index
     print(f"{num_xml_files}/{num_xml_files}")
-    data_set_list = list(data_set.values())
-    return data_set_list
+
+    data_set = []
+    for entry in entries.values():
+        if isinstance(entry, dict):
+            filter_pipeline.record(None)
+            data_set.append(entry)
+        else:
+            filter_pipeline.record(entry)
+    return data_set
 
 
 def has_excluded_ref_type(article):
@@ -71,7 +127,7 @@ def is_problematic_article(problematic_journal_nlmids, article):
         return False
 
     date_completed_str = article["date_completed"]
-    year_completed = dt.strptime(date_completed_str, cfg.DATE_FORMAT).date().year
+    year_completed = parse_year(date_completed_str, cfg.DATE_FORMAT)
     
     nlm_id = article["journal_nlmid"]
     is_problematic_journal = nlm_id in problematic_journal_nlmids
@@ -80,28 +136,21 @@ def is_problematic_article(problematic_journal_nlmids, article):
     return is_problematic
 
 
-def is_selectively_indexed(indexing_periods, article):
-    nlm_id = article["journal_nlmid"]
-    pub_year = article["pub_year"]
-    if nlm_id not in indexing_periods:
-        return False
-    for indexing_period in indexing_periods[nlm_id]:
-        if pub_year > indexing_period["start_year"] and (indexing_period["end_year"] is None or pub_year < indexing_period["end_year"]):
-            return True
-    return False
+def is_selectively_indexed(indexing_period_index, article):
+    return indexing_period_index.contains(article["journal_nlmid"], article["pub_year"])
 
 
 def is_bmcs_manual_labeled(article):
     result = ((article["bmcs_result"] is not None) and
               (article["bmcs_result"] == cfg.BMCS_UNCERTAIN_RESULT) and
-              (parse_date(article["bmcs_processed_date"], cfg.DATE_FORMAT) <= cfg.MAX_PROCESSED_DATE))
+              (get_date_ordinal(article, "bmcs_processed_date", cfg.DATE_FORMAT) <= MAX_PROCESSED_DATE_ORDINAL))
     return result
 
 
 def is_manual_labeled(article):
     result = ((article["bmcs_result"] is None) and
               (article["date_completed"] is not None) and
-              (parse_date(article["date_completed"], cfg.DATE_FORMAT) <= cfg.MAX_PROCESSED_DATE))
+              (get_date_ordinal(article, "date_completed", cfg.DATE_FORMAT) <= MAX_PROCESSED_DATE_ORDINAL))
     return result
 
 
@@ -109,42 +158,33 @@ def run(workdir, num_xml_files):
     
     BMCS_RESULTS_FILEPATH = os.path.join(workdir, cfg.BMCS_RESULTS_FILENAME)
     PROBLEMATIC_JOURNALS_FILEPATH = os.path.join(workdir, cfg.PROBLEMATIC_JOURNALS_FILENAME)
-    TRAIN_SET_FILEPATH = os.path.join(workdir, cfg.TRAIN_SET_FILENAME)
-    VAL_SET_FILEPATH = os.path.join(workdir, cfg.VAL_SET_FILENAME)
+    TRAIN_SET_FILEPATH = get_dataset_filepath(workdir, cfg.TRAIN_SET_NAME)
+    VAL_SET_FILEPATH = get_dataset_filepath(workdir, cfg.VAL_SET_NAME)
     SELECTIVELY_INDEXED_JOURNALS_FILEPATH = os.path.join(workdir, cfg.SELECTIVELY_INDEXED_JOURNALS_FILENAME)
-    TEST_SET_FILEPATH = os.path.join(workdir, cfg.TEST_SET_FILENAME)
-
-    data_set = create_dataset(workdir, num_xml_files)
-    print(f"Dataset size: {len(data_set)}")
+    TEST_SET_FILEPATH = get_dataset_filepath(workdir, cfg.TEST_SET_NAME)
 
     bmcs_processing_data = load_bmcs_processing_data(BMCS_RESULTS_FILEPATH)
-    add_bmcs_processing_data(data_set, bmcs_processing_data)
-
-    data_set = [article for article in data_set if article["pub_year"] <= cfg.TEST_SET_YEAR]
-    print(f"Dataset size (exclude published after test year): {len(data_set)}")
-
-    data_set = [article for article in data_set if not has_excluded_ref_type(article)]
-    print(f"Dataset size (exclude ref types): {len(data_set)}")
-
     problematic_journal_nlmids = load_problematic_journal_nlmids(PROBLEMATIC_JOURNALS_FILEPATH)
-    data_set = [article for article in data_set if not is_problematic_article(problematic_journal_nlmids, article)]
-    print(f"Dataset size (exclude problematic journals): {len(data_set)}")
 
+    data_set_pipeline = FilterPipeline([
+        ("Dataset size (exclude published after test year)", lambda article: article["pub_year"] <= cfg.TEST_SET_YEAR),
+        ("Dataset size (exclude ref types)", lambda article: not has_excluded_ref_type(article)),
+        ("Dataset size (exclude problematic journals)", lambda article: not is_problematic_article(problematic_journal_nlmids, article)),
+        ])
+    data_set = create_dataset(workdir, num_xml_files, data_set_pipeline, bmcs_processing_data)
+    data_set_pipeline.print_report("Dataset size")
     if not cfg.USE_EXISTING_VAL_TEST_SETS:
-        test_set_candidates = [article for article in data_set if article["pub_year"] == cfg.TEST_SET_YEAR]
-        print(f"Test set candidate size: {len(test_set_candidates)}")
-
         selectively_indexed_journals = json.load(open(SELECTIVELY_INDEXED_JOURNALS_FILEPATH, "rt", encoding=cfg.ENCODING))
         selectively_indexed_journal_nlmids = set(selectively_indexed_journals.keys())
 
-        test_set_candidates = [article for article in test_set_candidates if article["journal_nlmid"] in selectively_indexed_journal_nlmids]
-        print(f"Test set candidate size (selectively indexed journals): {len(test_set_candidates)}")
-    
-        test_set_candidates = [article for article in test_set_candidates if article["bmcs_processed_date"]]
-        print(f"Test set candidate size (bmcs processed date): {len(test_set_candidates)}")
-
-        test_set_candidates = [article for article in test_set_candidates if parse_date(article["bmcs_processed_date"], cfg.DATE_FORMAT) <= cfg.MAX_PROCESSED_DATE ]
-        print(f"Test set candidate size (exclude after max bmcs processed date): {len(test_set_candidates)}")
+        test_set_pipeline = FilterPipeline([
+            ("Test set candidate size", lambda article: article["pub_year"] == cfg.TEST_SET_YEAR),
+            ("Test set candidate size (selectively indexed journals)", lambda article: article["journal_nlmid"] in selectively_indexed_journal_nlmids),
+            ("Test set candidate size (bmcs processed date)", lambda article: article["bmcs_processed_date"]),
+            ("Test set candidate size (exclude after max bmcs processed date)", lambda article: get_date_ordinal(article, "bmcs_processed_date", cfg.DATE_FORMAT) <= MAX_PROCESSED_DATE_ORDINAL),
+            ])
+        test_set_candidates = list(test_set_pipeline.filter(data_set))
+        test_set_pipeline.print_report()
 
         test_set_candidates = random.sample(test_set_candidates, len(test_set_candidates))
         val_test_set_size = cfg.VAL_SET_SIZE + cfg.TEST_SET_SIZE
@@ -156,8 +196,8 @@ def run(workdir, num_xml_files):
         print("Saving test set...")
         save_dataset(test_set, TEST_SET_FILEPATH)
 
-    test_set = load_dataset(TEST_SET_FILEPATH, cfg.ENCODING)
-    val_set = load_dataset(VAL_SET_FILEPATH, cfg.ENCODING)
+    test_set = load_dataset(TEST_SET_FILEPATH, ["pmid"])
+    val_set = load_dataset(VAL_SET_FILEPATH, ["pmid"])
     print(f"Test set size: {len(test_set)}")
     print(f"Validation set size: {len(val_set)}")
 
@@ -166,11 +206,12 @@ def run(workdir, num_xml_files):
     val_test_set_pmids = set(val_test_set_pmids)
     print(f"Val test set pmid count: {len(val_test_set_pmids)}")
 
-    train_set_candidates = [article for article in data_set if is_manual_labeled(article) or is_bmcs_manual_labeled(article) ]
-    print(f"Train set candidate size: {len(train_set_candidates)}")
-
-    train_set_candidates = [article for article in train_set_candidates if article["pmid"] not in val_test_set_pmids]
-    print(f"Train set candidate size (no val test set pmids): {len(train_set_candidates)}")
+    train_set_pipeline = FilterPipeline([
+        ("Train set candidate size", lambda article: is_manual_labeled(article) or is_bmcs_manual_labeled(article)),
+        ("Train set candidate size (no val test set pmids)", lambda article: article["pmid"] not in val_test_set_pmids),
+        ])
+    train_set_candidates = list(train_set_pipeline.filter(data_set))
+    train_set_pipeline.print_report()
 
     train_set = random.sample(train_set_candidates, len(train_set_candidates))
     print(f"Train set size: {len(train_set)}")
@@ -178,7 +219,3 @@ def run(workdir, num_xml_files):
     print("Saving train set...")
     save_dataset(train_set, TRAIN_SET_FILEPATH)
 
-
-def save_dataset(dataset, filepath):
-    with gzip.open(filepath, "wt", encoding=cfg.ENCODING) as save_file:
-         json.dump(dataset, save_file, ensure_ascii=False, indent=4)
\ No newline at end of file
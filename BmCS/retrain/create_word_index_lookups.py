@@ -1,41 +1,38 @@
-from collections import defaultdict
+from .cnn.settings import get_config
+from collections import Counter
 from . import config as cfg
-from .helper import load_dataset
-import json
+from .dataset_storage import get_dataset_filepath, load_dataset
+from .helper import get_file_fingerprint
 import os.path
-from nltk.tokenize import word_tokenize
 from pickle import dump
+from .token_cache import get_token_cache_filepath, save_token_cache, tokenize_dataset
 
 
 OFFSET = 2
 
 
-def create_dict(train_set):       
-    token_counts = defaultdict(int)
-    num_articles = len(train_set)
-    for idx, article in enumerate(train_set):
-        if idx % 10000 == 0: 
-            print(f"{idx}/{num_articles}", end="\r")
-        title = article["title"]
-        abstract = article["abstract"]
-        title_tokens = tokenize(title)
-        abstract_tokens = tokenize(abstract)
-        tokens = title_tokens + abstract_tokens
-        for token in tokens:
-            token_counts[token] += 1
-    print(f"{num_articles}/{num_articles}")
-    sorted_items = sorted(token_counts.items(), key=lambda x: x[1], reverse=True)
+def create_dict_from_shards(shards):
+    token_counts = Counter()
+    for shard in shards:
+        token_counts.update(shard.get_token_counts())
+
+    # Ties are broken by token, so the lookup does not depend on the article or shard order
+    sorted_items = sorted(token_counts.items(), key=lambda x: (-x[1], x[0]))
     lookup = { item[0]: index + OFFSET for index, item in enumerate(sorted_items) }
     return lookup
 
 
-def run(workdir):
-    TRAIN_SET_FILEPATH = os.path.join(workdir, cfg.TRAIN_SET_FILENAME)
+def run(workdir, jobs=1):
+    TRAIN_SET_FILEPATH = get_dataset_filepath(workdir, cfg.TRAIN_SET_NAME)
+    TRAIN_SET_TOKEN_CACHE_FILEPATH = get_token_cache_filepath(workdir, cfg.TRAIN_SET_NAME)
     WORD_INDEX_DICT_FILEPATH = os.path.join(workdir, cfg.WORD_INDEX_DICT_FILENAME)
     WORD_INDEX_TXT_FILEPATH = os.path.join(workdir, cfg.WORD_INDEX_TXT_FILENAME)
 
-    train_set = load_dataset(TRAIN_SET_FILEPATH, cfg.ENCODING)
-    word_index_dict = create_dict(train_set)
+    train_set = load_dataset(TRAIN_SET_FILEPATH, ["pmid", "title", "abstract"])
+    
+    # The training set is tokenized once, and the tokens are used both to build the word index lookup and the token cache used for CNN training
+    shards = tokenize_dataset(train_set, jobs)
+    word_index_dict = create_dict_from_shards(shards)
 
     with open(WORD_INDEX_DICT_FILEPATH, "wb") as wid_file:
         dump(word_index_dict, wid_file)
@@ -45,8 +42,6 @@ def run(workdir):
         for word, index in sorted(word_index_dict.items(), key=lambda x: x[1])[:vocab_size]:
             wit_file.write(f"{index}\t{word}\n")
 
-
-def tokenize(text):
-    text = text.lower()
-    tokens = word_tokenize(text)
-    return tokens
\ No newline at end of file
+    print("Saving train set token cache...")
+    pmids = [article["pmid"] for article in train_set]
+    save_token_cache(TRAIN_SET_TOKEN_CACHE_FILEPATH, pmids, shards, word_index_dict, get_config().inputs.preprocessing.unknown_word_index, get_file_fingerprint(WORD_INDEX_DICT_FILEPATH))
@@ -0,0 +1,300 @@
+from array import array
+from . import config as cfg
+import gzip
+import json
+import numpy as np
+import os
+import shutil
+
+
+BLOCK_SIZE = 10000
+COLUMNAR_EXTENSION = ".cols"
+JSON_EXTENSION = ".json.gz"
+SCHEMA_FILENAME = "schema.json"
+STR_LIST_SEPARATOR = "\x1f"
+
+BOOL = "bool"
+INT = "int"
+JSON = "json"
+STR = "str"
+STR_LIST = "str_list"
+
+COLUMN_TYPES = { "pmid": INT,
+                 "title": STR,
+                 "abstract": STR,
+                 "affiliations": STR,
+                 "pub_year": INT,
+                 "date_completed": STR,
+                 "journal_nlmid": STR,
+                 "is_indexed": BOOL,
+                 "ref_types": STR_LIST,
+                 "bmcs_processed_date": STR,
+                 "bmcs_result": INT,
+                 "date_completed_ordinal": INT,
+                 "bmcs_processed_date_ordinal": INT,
+                 "year_completed": INT,
+                 }
+
+
+def find_dataset_filepath(dirpath, name):
+    """Returns the path of an existing dataset, which may have been saved in either format, e.g. by an earlier release."""
+    for dataset_format in (cfg.DATASET_FORMAT, "columnar", "json"):
+        filepath = get_dataset_filepath(dirpath, name, dataset_format)
+        if os.path.exists(filepath):
+            return filepath
+    return get_dataset_filepath(dirpath, name)
+
+
+def get_dataset_filepath(dirpath, name, dataset_format=cfg.DATASET_FORMAT):
+    if dataset_format == "columnar":
+        extension = COLUMNAR_EXTENSION
+    elif dataset_format == "json":
+        extension = JSON_EXTENSION
+    else:
+        raise ValueError(f"Unknown dataset format: {dataset_format}")
+    return os.path.join(dirpath, name + extension)
+
+
+def iter_dataset(path, columns=None):
+    if _is_columnar(path):
+        yield from ColumnarDataset(path, columns)
+    else:
+        for article in _load_json(path):
+            yield _project(article, columns)
+
+
+def load_dataset(path, columns=None):
+    if _is_columnar(path):
+        dataset = list(ColumnarDataset(path, columns))
+    else:
+        dataset = _load_json(path)
+        if columns is not None:
+            dataset = [_project(article, columns) for article in dataset]
+    return dataset
+
+
+def open_dataset_writer(path):
+    if _is_columnar(path):
+        return _ColumnarWriter(path)
+    else:
+        return _JsonWriter(path)
+
+
+def save_dataset(dataset, path):
+    with open_dataset_writer(path) as writer:
+        for article in dataset:
+            writer.write(article)
+
+
+class ColumnarDataset:
+    """Read only view of a columnar dataset.
+
+    Columns are stored as NumPy arrays (strings as UTF-8 bytes plus offsets) and
+    are memory mapped, so only the projected columns are ever paged in.
+    """
+
+    def __init__(self, path, columns=None):
+        with open(os.path.join(path, SCHEMA_FILENAME), "rt", encoding=cfg.ENCODING) as schema_file:
+            schema = json.load(schema_file)
+        self._num_rows = schema["num_rows"]
+        column_types = schema["columns"]
+        if columns is None or self._num_rows == 0: # An empty dataset has no columns
+            columns = list(column_types)
+        self._columns = { name: _ColumnReader(path, name, column_types[name]) for name in columns if name in column_types }
+
+    def __len__(self):
+        return self._num_rows
+
+    def __iter__(self):
+        names = list(self._columns)
+        for start in range(0, self._num_rows, BLOCK_SIZE):
+            end = min(start + BLOCK_SIZE, self._num_rows)
+            values = [self._columns[name].read(start, end) for name in names]
+            for row in zip(*values):
+                yield dict(zip(names, row))
+
+    def column(self, name):
+        if self._num_rows == 0:
+            return []
+        values = self._columns[name].read(0, self._num_rows)
+        return values
+
+
+class _ColumnReader:
+
+    def __init__(self, path, name, column_type):
+        filepath_prefix = os.path.join(path, name)
+        self._column_type = column_type
+        if column_type in (BOOL, INT):
+            self._values = np.load(filepath_prefix + ".npy", mmap_mode="r")
+        else:
+            self._offsets = np.load(filepath_prefix + ".offsets.npy", mmap_mode="r")
+            data_filepath = filepath_prefix + ".bytes"
+            self._data = np.memmap(data_filepath, dtype=np.uint8, mode="r") if os.path.getsize(data_filepath) > 0 else np.empty(0, dtype=np.uint8)
+        nulls_filepath = filepath_prefix + ".nulls.npy"
+        self._nulls = np.load(nulls_filepath, mmap_mode="r") if os.path.isfile(nulls_filepath) else None
+
+    def read(self, start, end):
+        if self._column_type in (BOOL, INT):
+            values = self._values[start:end].tolist()
+        else:
+            values = self._read_text(start, end)
+        if self._nulls is not None:
+            nulls = self._nulls[start:end].tolist()
+            values = [None if is_null else value for value, is_null in zip(values, nulls)]
+        return values
+
+    def _read_text(self, start, end):
+        offsets = self._offsets[start:end + 1].tolist()
+        block_start = offsets[0]
+        block = self._data[block_start:offsets[-1]].tobytes()
+        texts = [block[offsets[idx] - block_start: offsets[idx + 1] - block_start].decode(cfg.ENCODING) for idx in range(end - start)]
+        if self._column_type == STR_LIST:
+            values = [text.split(STR_LIST_SEPARATOR) if text else [] for text in texts]
+        elif self._column_type == JSON:
+            values = [json.loads(text) if text else None for text in texts]
+        else:
+            values = texts
+        return values
+
+
+class _ColumnarWriter:
+
+    def __init__(self, path):
+        self._path = path
+        self._tmp_path = path + ".tmp"
+        if os.path.isdir(self._tmp_path):
+            shutil.rmtree(self._tmp_path)
+        os.mkdir(self._tmp_path)
+        self._columns = None
+        self._num_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+
+    def close(self):
+        if self._columns is None:
+            self._columns = {}
+        for column in self._columns.values():
+            column.close()
+        schema = { "num_rows": self._num_rows, "columns": { name: column.column_type for name, column in self._columns.items() } }
+        with open(os.path.join(self._tmp_path, SCHEMA_FILENAME), "wt", encoding=cfg.ENCODING) as schema_file:
+            json.dump(schema, schema_file, indent=4)
+        if os.path.isdir(self._path):
+            shutil.rmtree(self._path)
+        os.replace(self._tmp_path, self._path)
+
+    def write(self, article):
+        if self._columns is None:
+            self._columns = { name: _ColumnWriter(self._tmp_path, name, COLUMN_TYPES.get(name, JSON)) for name in article }
+        elif article.keys() != self._columns.keys(): # The columns are those of the first article
+            missing_keys = sorted(self._columns.keys() - article.keys())
+            extra_keys = sorted(article.keys() - self._columns.keys())
+            raise ValueError(f"Article {self._num_rows} does not match the columns of the first article: missing {missing_keys}, extra {extra_keys}")
+        for name, column in self._columns.items():
+            column.append(article[name])
+        self._num_rows += 1
+
+    def _abort(self):
+        if self._columns is not None:
+            for column in self._columns.values():
+                column.abort()
+        shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+
+class _ColumnWriter:
+
+    def __init__(self, path, name, column_type):
+        self.column_type = column_type
+        self._filepath_prefix = os.path.join(path, name)
+        self._nulls = bytearray()
+        if column_type in (BOOL, INT):
+            self._values = array("q")
+        else:
+            self._offsets = array("q", [0])
+            self._data_file = open(self._filepath_prefix + ".bytes", "wb")
+
+    def abort(self):
+        if self.column_type not in (BOOL, INT):
+            self._data_file.close()
+
+    def append(self, value):
+        self._nulls.append(value is None)
+        if self.column_type in (BOOL, INT):
+            self._values.append(int(value) if value is not None else 0)
+        else:
+            if value is None:
+                text = ""
+            elif self.column_type == STR_LIST:
+                text = STR_LIST_SEPARATOR.join(value)
+            elif self.column_type == JSON:
+                text = json.dumps(value, ensure_ascii=False)
+            else:
+                text = value
+            data = text.encode(cfg.ENCODING)
+            self._data_file.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self):
+        if self.column_type in (BOOL, INT):
+            dtype = np.bool_ if self.column_type == BOOL else np.int64
+            np.save(self._filepath_prefix + ".npy", np.array(self._values, dtype=dtype))
+        else:
+            self._data_file.close()
+            np.save(self._filepath_prefix + ".offsets.npy", np.array(self._offsets, dtype=np.int64))
+        if any(self._nulls):
+            np.save(self._filepath_prefix + ".nulls.npy", np.frombuffer(bytes(self._nulls), dtype=np.bool_))
+
+
+class _JsonWriter:
+
+    def __init__(self, path):
+        self._path = path
+        self._tmp_path = path + ".tmp"
+        self._file = gzip.open(self._tmp_path, "wt", encoding=cfg.ENCODING)
+        self._file.write("[")
+        self._separator = "\n"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self._tmp_path)
+
+    def close(self):
+        self._file.write("\n]\n")
+        self._file.close()
+        os.replace(self._tmp_path, self._path)
+
+    def write(self, article):
+        self._file.write(self._separator)
+        json.dump(article, self._file, ensure_ascii=False)
+        self._separator = ",\n"
+
+
+def _is_columnar(path):
+    return path.endswith(COLUMNAR_EXTENSION)
+
+
+def _load_json(path):
+    with gzip.open(path, "rt", encoding=cfg.ENCODING) as file:
+        dataset = json.load(file)
+    if isinstance(dataset, dict): # Extracted MEDLINE data files written by earlier releases
+        dataset = dataset["articles"]
+    return dataset
+
+
+def _project(article, columns):
+    if columns is None:
+        return article
+    return { name: article[name] for name in columns if name in article }
@@ -1,36 +1,48 @@
 from .cnn import pred as cnn_pred
+from .cnn.settings import get_config
 from . import config as cfg
-from .helper import load_dataset, load_pickled_object, preprocess_voting_model_data
+from .dataset_storage import get_dataset_filepath, load_dataset
+from .feature_cache import FeatureCache, transform_cached
+from .helper import CNN_MODEL_COLUMNS, get_file_fingerprint, load_pickled_object, preprocess_voting_model_data, VOTING_MODEL_COLUMNS
 import joblib
 import numpy as np
 import os.path
-from sklearn.metrics import precision_score, recall_score
+from .retrain_voting import FEATURE_PIPES
+from .token_cache import get_token_cache_filepath, load_or_build_token_cache
 
 
-def compute_precision_recall(predictions, threshold):
+def compute_precision_recall_curve(predictions):
+    """Precision and recall at every distinct score, ordered by decreasing threshold.
+
+    The articles are sorted by score once and the true/false positive counts at each
+    threshold are cumulative sums, so the whole curve costs O(n log n).
+    """
     y_true = predictions[:,0]
-    y_pred = predictions[:,1]
-    y_pred_thresh = y_pred >= threshold
-    y_pred_thresh = y_pred_thresh.astype('float32')
-
-    if (np.sum(y_pred_thresh) == 0.):
-        return 1., 0.
-
-    precision = precision_score(y_true, y_pred_thresh, average='binary')
-    recall = recall_score(y_true, y_pred_thresh, average='binary')
-    return precision, recall
-
-
-def get_combined_predictions(cnn_predictions, voting_predictions):
-    combined_predictions = {}
-    for pmid in cnn_predictions:
-        cnn_prediction = cnn_predictions[pmid]
-        voting_prediction = voting_predictions[pmid]
-        act = voting_prediction['act']
-        cnn_score = cnn_prediction['score']
-        voting_score = voting_prediction['score']
-        combined_score = voting_score*cnn_score
-        combined_predictions[pmid] = { 'act': act, 'score': combined_score}
+    y_score = predictions[:,1]
+    order = np.argsort(-y_score, kind='mergesort')
+    y_true = y_true[order]
+    y_score = y_score[order]
+
+    # The last article of each run of equal scores
+    threshold_indices = np.flatnonzero(np.diff(y_score, append=-np.inf))
+    true_positives = np.cumsum(y_true)[threshold_indices]
+    predicted_positives = threshold_indices + 1.
+    num_positives = true_positives[-1] if len(true_positives) > 0 else 0.
+
+    thresholds = y_score[threshold_indices]
+    precision = true_positives / predicted_positives
+    recall = true_positives / num_positives if num_positives > 0 else np.zeros_like(true_positives)
+    return thresholds, precision, recall
+
+
+def get_combined_predictions(cnn_pmids, cnn_scores, voting_pmids, voting_labels, voting_scores):
+    """Returns the labels and the product of the scores of the articles predicted by both models, ordered by pmid.
+
+    The CNN may predict fewer articles than the voting model (its prediction limit).
+    """
+    _, cnn_indices, voting_indices = np.intersect1d(cnn_pmids, voting_pmids, assume_unique=True, return_indices=True)
+    combined_scores = voting_scores[voting_indices]*cnn_scores[cnn_indices]
+    combined_predictions = np.column_stack([voting_labels[voting_indices], combined_scores]).astype(np.float64)
     return combined_predictions
 
 
@@ -38,29 +50,36 @@ def get_cnn_predictions(workdir, val_set):
     CNN_DATA_DIR = workdir
     CNN_RUNS_DIR = os.path.join(workdir, cfg.CNN_DATA_DIR)
     JOURNAL_ID_DICT_FILEPATH = os.path.join(workdir, cfg.JOURNAL_ID_DICT_FILENAME)
+    VAL_SET_TOKEN_CACHE_FILEPATH = get_token_cache_filepath(workdir, cfg.VAL_SET_NAME)
     WORD_INDEX_DICT_FILEPATH = os.path.join(workdir, cfg.WORD_INDEX_DICT_FILENAME)
 
     word_index_lookup = load_pickled_object(WORD_INDEX_DICT_FILEPATH)
     journal_id_lookup = load_pickled_object(JOURNAL_ID_DICT_FILEPATH)
-    predictions = cnn_pred.run(CNN_DATA_DIR, CNN_RUNS_DIR, word_index_lookup, journal_id_lookup, val_set, cfg.PP_CONFIG)
-    return predictions
+    val_token_cache = load_or_build_token_cache(VAL_SET_TOKEN_CACHE_FILEPATH, val_set, word_index_lookup, get_config().inputs.preprocessing.unknown_word_index, get_file_fingerprint(WORD_INDEX_DICT_FILEPATH))
+    pmids, labels, scores = cnn_pred.run(CNN_DATA_DIR, CNN_RUNS_DIR, word_index_lookup, journal_id_lookup, val_set, cfg.PP_CONFIG, val_token_cache)
+    return pmids, labels, scores
 
 
 def get_voting_predictions(workdir, val_set):
     VOTING_MODEL_FILEPATH = os.path.join(workdir, cfg.VOTING_DATA_DIR, cfg.VOTING_MODEL_FILENAME)
 
     model = joblib.load(VOTING_MODEL_FILEPATH)
-    val_data = preprocess_voting_model_data(val_set)
-    scores = model.predict_proba(val_data)
-
-    predictions = {}
-    for idx in range(len(val_set)):
-        article = val_set[idx]
-        pmid = article['pmid']
-        act = float(article['is_indexed'])
-        score = scores[idx, 0]
-        predictions[pmid] = { 'act': act, 'score': score }
-    return predictions
+    union, ensemble = model.named_steps["union"], model.named_steps["ensemble"]
+    # The features only depend on the saved model and the validation set texts
+    cache = FeatureCache(os.path.join(workdir, cfg.FEATURE_CACHE_DIR), cfg.FEATURE_CACHE_MAX_SIZE)
+    model_fingerprint = get_file_fingerprint(VOTING_MODEL_FILEPATH)
+    columns = [column for _, column in FEATURE_PIPES]
+    # One chunk of features at a time, so memory does not grow with the size of the evaluation set
+    chunk_scores = []
+    for start in range(0, len(val_set), cfg.VOTING_PREDICTION_CHUNK_SIZE):
+        chunk_data = preprocess_voting_model_data(val_set[start:start + cfg.VOTING_PREDICTION_CHUNK_SIZE])
+        features = transform_cached(cache, union, chunk_data, model_fingerprint, columns)
+        chunk_scores.append(ensemble.predict_proba(features)[:, 0])
+    scores = np.concatenate(chunk_scores or [np.empty(0)])
+
+    pmids = np.array([article['pmid'] for article in val_set], dtype=np.int64)
+    labels = np.array([article['is_indexed'] for article in val_set], dtype=np.float64)
+    return pmids, labels, scores
 
 
 # def _save_test_set_predictions(workdir, filename,  combined_predictions):
@@ -80,58 +99,70 @@ def get_voting_predictions(workdir, val_set):
             
 
 def run(workdir):
+    OPT_THRESHOLDS_CURVE_FILEPATH_TEMPLATE = os.path.join(workdir, cfg.OPT_THRESHOLDS_CURVE_FILENAME_TEMPLATE)
     OPT_THRESHOLDS_FILEPATH_TEMPLATE = os.path.join(workdir, cfg.OPT_THRESHOLDS_FILENAME_TEMPLATE)
-    VAL_SET_FILEPATH = os.path.join(workdir, cfg.VAL_SET_FILENAME)
+    VAL_SET_FILEPATH = get_dataset_filepath(workdir, cfg.VAL_SET_NAME)
 
-    val_set = load_dataset(VAL_SET_FILEPATH, cfg.ENCODING)
+    val_set = load_dataset(VAL_SET_FILEPATH, sorted(set(CNN_MODEL_COLUMNS + VOTING_MODEL_COLUMNS)))
     #val_set = [c for c in val_set if c["journal_nlmid"] != "101653440" ] # v3 exclude Sci Adv due to false negatives
-    cnn_predictions = get_cnn_predictions(workdir, val_set)
-    voting_predictions = get_voting_predictions(workdir, val_set)
-    combined_predictions = get_combined_predictions(cnn_predictions, voting_predictions)
+    cnn_pmids, cnn_labels, cnn_scores = get_cnn_predictions(workdir, val_set)
+    voting_pmids, voting_labels, voting_scores = get_voting_predictions(workdir, val_set)
+    combined_predictions = get_combined_predictions(cnn_pmids, cnn_scores, voting_pmids, voting_labels, voting_scores)
 
     #_save_test_set_predictions(workdir, "val_set_cnn_predictions.csv", cnn_predictions)
     #_save_test_set_predictions(workdir, "val_set_voting_predictions.csv", voting_predictions)
     #_save_test_set_predictions(workdir, "val_set_predictions.csv", combined_predictions)
     
-    cnn_predictions = to_numpy(cnn_predictions)
-    voting_predictions = to_numpy(voting_predictions)
-    combined_predictions = to_numpy(combined_predictions)
+    cnn_predictions = np.column_stack([cnn_labels, cnn_scores]).astype(np.float64)
+    voting_predictions = np.column_stack([voting_labels, voting_scores]).astype(np.float64)
 
     #np.save("cnn_predictions.npy", cnn_predictions)
     #np.save("voting_predictions.npy", voting_predictions)
     #np.save("combined_predictions.npy", combined_predictions)
 
     filepath = OPT_THRESHOLDS_FILEPATH_TEMPLATE.format("cnn")
-    save_optimum_thresholds(cnn_predictions, filepath)
+    curve_filepath = OPT_THRESHOLDS_CURVE_FILEPATH_TEMPLATE.format("cnn")
+    save_optimum_thresholds(cnn_predictions, filepath, curve_filepath)
 
     filepath = OPT_THRESHOLDS_FILEPATH_TEMPLATE.format("voting")
-    save_optimum_thresholds(voting_predictions, filepath)
+    curve_filepath = OPT_THRESHOLDS_CURVE_FILEPATH_TEMPLATE.format("voting")
+    save_optimum_thresholds(voting_predictions, filepath, curve_filepath)
 
     filepath = OPT_THRESHOLDS_FILEPATH_TEMPLATE.format("combined")
-    save_optimum_thresholds(combined_predictions, filepath)
+    curve_filepath = OPT_THRESHOLDS_CURVE_FILEPATH_TEMPLATE.format("combined")
+    save_optimum_thresholds(combined_predictions, filepath, curve_filepath)
 
 
-def save_optimum_thresholds(predictions, save_filepath):
-    
-    precision, recall, threshold = 0., 1., 0.
-    while (recall > cfg.OPT_THRESHOLDS_TARGET_RECALL):
-        last_precision, last_recall, last_threshold = precision, recall, threshold
-        threshold += cfg.OPT_THRESHOLDS_DELTA
-        precision, recall = compute_precision_recall(predictions, threshold)
-    
+def save_optimum_thresholds(predictions, save_filepath, curve_save_filepath=None):
+    thresholds, precision, recall = compute_precision_recall_curve(predictions)
+
+    # Highest threshold with recall above the target. Recall never decreases as the threshold is lowered.
+    last_precision, last_recall, last_threshold = 0., 1., 0.
+    above_target_recall = recall > cfg.OPT_THRESHOLDS_TARGET_RECALL
+    if np.any(above_target_recall):
+        idx = np.argmax(above_target_recall)
+        last_precision, last_recall, last_threshold = float(precision[idx]), float(recall[idx]), float(thresholds[idx])
+
     with open(save_filepath, 'wt', encoding=cfg.ENCODING) as file:
         file.write(f"Threshold: {last_threshold}, Precision: {last_precision}, Recall: {last_recall}\n")
 
-    precision, recall, threshold = 1., 0., 1.
-    while (precision > cfg.OPT_THRESHOLDS_TARGET_PRECISION):
-        last_precision, last_recall, last_threshold = precision, recall, threshold
-        threshold -= cfg.OPT_THRESHOLDS_DELTA
-        precision, recall = compute_precision_recall(predictions, threshold)
-    
+    # Lowest threshold reached by lowering the threshold from 1 before precision first drops to the target
+    last_precision, last_recall, last_threshold = 1., 0., 1.
+    at_target_precision = precision <= cfg.OPT_THRESHOLDS_TARGET_PRECISION
+    idx = np.argmax(at_target_precision) - 1 if np.any(at_target_precision) else len(precision) - 1
+    if idx >= 0:
+        last_precision, last_recall, last_threshold = float(precision[idx]), float(recall[idx]), float(thresholds[idx])
+
     with open(save_filepath, 'at', encoding=cfg.ENCODING) as file:
         file.write(f"Threshold: {last_threshold}, Precision: {last_precision}, Recall: {last_recall}\n")
 
+    if curve_save_filepath:
+        save_precision_recall_curve(thresholds, precision, recall, curve_save_filepath)
+
+
+def save_precision_recall_curve(thresholds, precision, recall, save_filepath):
+    with open(save_filepath, 'wt', encoding=cfg.ENCODING) as file:
+        file.write("threshold,precision,recall\n")
+        for threshold_value, precision_value, recall_value in zip(thresholds.tolist(), precision.tolist(), recall.tolist()):
+            file.write(f"{threshold_value},{precision_value},{recall_value}\n")
 
-def to_numpy(predictions):
-    array = np.array([[prediction['act'], prediction['score']] for prediction in predictions.values()])
-    return array
\ No newline at end of file
@@ -1,6 +1,6 @@
 from . import config as cfg
 import gzip
-from .helper import create_dir, load_indexing_periods
+from .helper import create_dir, IndexingPeriodIndex, load_indexing_periods
 import json
 import math
 import os
@@ -41,19 +41,14 @@ def run(workdir):
     downloaded_data_filepath_template = os.path.join(datadir, cfg.DOWNLOADED_DATA_FILENAME_TEMPLATE)
     selective_indexing_periods_filepath = os.path.join(workdir, cfg.SELECTIVE_INDEXING_PERIODS_FILENAME)
     
-    indexing_periods = load_indexing_periods(selective_indexing_periods_filepath, cfg.ENCODING, False)
+    indexing_period_index = IndexingPeriodIndex(load_indexing_periods(selective_indexing_periods_filepath, cfg.ENCODING, False))
 
     count = 0
-    num_journals = len(indexing_periods)
-    for idx, nlmid in enumerate(sorted(indexing_periods)):
+    nlmids = indexing_period_index.nlm_ids
+    num_journals = len(nlmids)
+    for idx, nlmid in enumerate(nlmids):
         print(f"{idx + 1}/{num_journals}", end="\r")    
-        for period in indexing_periods[nlmid]:
-            start_year = period["start_year"]
-            end_year = period["end_year"]
-
-            min_year = (start_year + 1)
-            max_year = (end_year - 1) if end_year is not None else cfg.TEST_SET_YEAR
-
+        for min_year, max_year in indexing_period_index.get_year_ranges(nlmid, cfg.TEST_SET_YEAR): # Overlapping periods are merged, so no year is downloaded twice
             webenv, query_key, num_results = esearch(nlmid, min_year, max_year)
         
             batch_size = cfg.EUTILS_RETMAX
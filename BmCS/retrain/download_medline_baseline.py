@@ -1,26 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from . import config as cfg
+import hashlib
 from .helper import create_dir
+import http.client
 import os.path
-from urllib.request import urlretrieve
+import threading
+import time
+from urllib.parse import urlsplit
 
 
-def run(workdir):
+CHUNK_SIZE = 1024*1024
+MD5_EXTENSION = ".md5"
+
+
+class _Downloader:
+
+    def __init__(self, base_url, timeout):
+        split_url = urlsplit(base_url)
+        self._connection_class = http.client.HTTPSConnection if split_url.scheme == "https" else http.client.HTTPConnection
+        self._host = split_url.netloc
+        self._base_path = split_url.path
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def download(self, filename, filepath, max_retries):
+        for attempt in range(max_retries + 1):
+            if attempt > 0:
+                time.sleep(cfg.DOWNLOAD_RETRY_BACKOFF*2**(attempt - 1)) # Exponential backoff, so a busy server is not retried right away
+            try:
+                expected_md5 = self._get_expected_md5(filename)
+                if os.path.isfile(filepath) and _md5(filepath) == expected_md5:
+                    return
+                self._download_file(filename, filepath)
+                if _md5(filepath) == expected_md5:
+                    return
+                os.remove(filepath) # Corrupt, start from scratch on the next attempt
+            except (OSError, http.client.HTTPException):
+                self._close_connection()
+                if attempt == max_retries:
+                    raise
+        raise IOError(f"MD5 checksum mismatch for {filename} after {max_retries + 1} attempts.")
+
+    def _close_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _download_file(self, filename, filepath):
+        existing_size = os.path.getsize(filepath) if os.path.isfile(filepath) else 0
+        headers = { "Range": f"bytes={existing_size}-" } if existing_size > 0 else {}
+        response = self._request(filename, headers)
+        if response.status == 416: # Range not satisfiable, the partial file is already at least as large as the remote file
+            response.read()
+            os.remove(filepath)
+            response = self._request(filename, {})
+        if response.status == 206:
+            mode = "ab"
+        elif response.status == 200:
+            mode = "wb"
+        else:
+            response.read()
+            raise IOError(f"Unexpected HTTP status {response.status} for {filename}.")
+        with open(filepath, mode) as file:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                file.write(chunk)
+        if response.length: # The connection was closed early, without an error. The partial file is resumed on the next attempt.
+            raise http.client.IncompleteRead(b"", response.length)
+
+    def _get_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._connection_class(self._host, timeout=self._timeout)
+            self._local.connection = connection
+        return connection
+
+    def _get_expected_md5(self, filename):
+        response = self._request(filename + MD5_EXTENSION, {})
+        text = response.read().decode(cfg.ENCODING)
+        if response.status != 200:
+            raise IOError(f"Unexpected HTTP status {response.status} for {filename + MD5_EXTENSION}.")
+        # Format: MD5(pubmed23n0001.xml.gz)= 0123456789abcdef0123456789abcdef
+        expected_md5 = text.strip().split("=")[-1].strip().lower()
+        return expected_md5
+
+    def _request(self, filename, headers):
+        connection = self._get_connection()
+        connection.request("GET", self._base_path + filename, headers=headers)
+        response = connection.getresponse()
+        return response
+
+
+def _md5(filepath):
+    md5 = hashlib.md5()
+    with open(filepath, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def run(workdir, num_workers=cfg.DOWNLOAD_WORKERS):
     START_DATA_FILE_NUM = 1
     END_DATA_FILE_NUM = cfg.NUM_BASLINE_FILES
-    
+
     datadir = os.path.join(workdir, cfg.MEDLINE_DATA_DIR)
     create_dir(datadir)
     DOWNLOADED_DATA_FILEPATH_TEMPLATE = os.path.join(datadir, cfg.DOWNLOADED_DATA_FILENAME_TEMPLATE)
-    URL_TEMPLATE = cfg.BASELINE_URL + cfg.BASELINE_FILENAME_TEMPLATE
-
-    for file_num in range(START_DATA_FILE_NUM, END_DATA_FILE_NUM + 1):
-        url = URL_TEMPLATE.format(file_num)
-        filepath = DOWNLOADED_DATA_FILEPATH_TEMPLATE.format(file_num)
-        print(f"{file_num}/{END_DATA_FILE_NUM}", end="\r")
-        if os.path.isfile(filepath):
-            continue
-        urlretrieve(url, filepath)
-        
-    print(f"{file_num}/{END_DATA_FILE_NUM}")
-
-    return cfg.NUM_BASLINE_FILES
\ No newline at end of file
+
+    downloader = _Downloader(cfg.BASELINE_URL, cfg.DOWNLOAD_TIMEOUT)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = []
+        for file_num in range(START_DATA_FILE_NUM, END_DATA_FILE_NUM + 1):
+            filename = cfg.BASELINE_FILENAME_TEMPLATE.format(file_num)
+            filepath = DOWNLOADED_DATA_FILEPATH_TEMPLATE.format(file_num)
+            futures.append(executor.submit(downloader.download, filename, filepath, cfg.DOWNLOAD_MAX_RETRIES))
+
+        try:
+            for count, future in enumerate(as_completed(futures), 1):
+                future.result()
+                print(f"{count}/{END_DATA_FILE_NUM}", end="\r")
+        except BaseException:
+            executor.shutdown(cancel_futures=True) # Fail now, rather than after every queued download
+            raise
+
+    print(f"{END_DATA_FILE_NUM}/{END_DATA_FILE_NUM}")
+
+    return cfg.NUM_BASLINE_FILES
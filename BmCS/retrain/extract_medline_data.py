@@ -1,39 +1,59 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from . import config as cfg
 from datetime import date
+from .dataset_storage import get_dataset_filepath, open_dataset_writer
 from dateutil.parser import parse
 import gzip
 from .helper import create_dir
-import json
-import os.path
+import os
 import re
+import shutil
 import xml.etree.ElementTree as ET
 
 
-MEDLINE_CITATION_NODE_PATH = "PubmedArticle/MedlineCitation"
+MEDLINE_CITATION_NODE_PATH = "MedlineCitation"
+PUBMED_ARTICLE_TAG = "PubmedArticle"
 
 
-def run(workdir, num_xml_files):
+def run(workdir, num_xml_files, jobs=1):
     datadir = os.path.join(workdir, cfg.MEDLINE_DATA_DIR)
 
     START_DATA_FILE_NUM = 1
     END_DATA_FILE_NUM = num_xml_files
 
     DATA_FILEPATH_TEMPLATE = os.path.join(datadir, cfg.DOWNLOADED_DATA_FILENAME_TEMPLATE)
+    LOG_DIR = os.path.join(datadir, "extract_data_logs")
     LOG_FILEPATH = os.path.join(datadir, "extract_data_log.txt")
-    JSON_FILEPATH_TEMPLATE = os.path.join(datadir, cfg.EXTRACTED_DATA_FILENAME_TEMPLATE)
-   
-    with open(LOG_FILEPATH, "wt", encoding=cfg.ENCODING) as log_file: 
-        for file_num in range(START_DATA_FILE_NUM, END_DATA_FILE_NUM + 1):
-            print(f"{file_num}/{END_DATA_FILE_NUM}", end="\r")
-            data_filepath = DATA_FILEPATH_TEMPLATE.format(file_num)
-            json_filepath = JSON_FILEPATH_TEMPLATE.format(file_num)
-            with gzip.open(data_filepath, "rt", encoding=cfg.ENCODING) as data_file, \
-                 gzip.open(json_filepath, "wt", encoding=cfg.ENCODING) as json_file:
-                json_file_data = _get_json_file_data(data_file, MEDLINE_CITATION_NODE_PATH, log_file)
-                json.dump(json_file_data, json_file, ensure_ascii=False, indent=4)
-            log_file.flush()
+    LOG_FILEPATH_TEMPLATE = os.path.join(LOG_DIR, "{0:04d}.txt")
+
+    create_dir(LOG_DIR)
+
+    tasks = []
+    for file_num in range(START_DATA_FILE_NUM, END_DATA_FILE_NUM + 1):
+        data_filepath = DATA_FILEPATH_TEMPLATE.format(file_num)
+        extracted_data_filepath = get_dataset_filepath(datadir, cfg.EXTRACTED_DATA_NAME_TEMPLATE.format(file_num))
+        log_filepath = LOG_FILEPATH_TEMPLATE.format(file_num)
+        if not _is_up_to_date(data_filepath, extracted_data_filepath, log_filepath):
+            tasks.append((data_filepath, extracted_data_filepath, log_filepath))
+    
+    num_skipped = END_DATA_FILE_NUM - len(tasks)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_extract_file, *task) for task in tasks]
+            for count, future in enumerate(as_completed(futures), num_skipped + 1):
+                future.result()
+                print(f"{count}/{END_DATA_FILE_NUM}", end="\r")
+    else:
+        for count, task in enumerate(tasks, num_skipped + 1):
+            _extract_file(*task)
+            print(f"{count}/{END_DATA_FILE_NUM}", end="\r")
     print(f"{END_DATA_FILE_NUM}/{END_DATA_FILE_NUM}")
 
+    with open(LOG_FILEPATH, "wt", encoding=cfg.ENCODING) as log_file:
+        for file_num in range(START_DATA_FILE_NUM, END_DATA_FILE_NUM + 1):
+            with open(LOG_FILEPATH_TEMPLATE.format(file_num), "rt", encoding=cfg.ENCODING) as file_log_file:
+                shutil.copyfileobj(file_log_file, log_file)
+
 
 def _article_is_relevant(article_metadata):
     pmid, title, abstract, affiliations, journal_nlmid, pub_year, date_completed, citation_status, comments_corrections_ref_types = article_metadata
@@ -134,6 +154,14 @@ def _extract_year_from_medlinedate(pmid, medlinedate_text, log_file):
     return pub_year
 
 
+def _extract_file(data_filepath, extracted_data_filepath, log_filepath):
+    with gzip.open(data_filepath, "rt", encoding=cfg.ENCODING) as data_file, \
+         open_dataset_writer(extracted_data_filepath) as writer, \
+         open(log_filepath, "wt", encoding=cfg.ENCODING) as log_file:
+        for article in _iter_articles(data_file, MEDLINE_CITATION_NODE_PATH, log_file):
+            writer.write(article)
+
+
 def _get_json_data_for_article(article_metadata):
     pmid, title, abstract, affiliations, journal_nlmid, pub_year, date_completed, citation_status, comments_corrections_ref_types = article_metadata
     ref_types = list(set(comments_corrections_ref_types))
@@ -150,12 +178,21 @@ def _get_json_data_for_article(article_metadata):
     return article
 
 
-def _get_json_file_data(data_file, medline_citation_node_path, log_file):
-    articles = []
-    root_node = ET.parse(data_file)
-    for medline_citation_node in root_node.findall(medline_citation_node_path):
-         article_metadata = _extract_article_metadata(medline_citation_node, log_file)
-         if _article_is_relevant(article_metadata):
-            article = _get_json_data_for_article(article_metadata)
-            articles.append(article)
-    return { "articles": articles }
\ No newline at end of file
+def _is_up_to_date(data_filepath, extracted_data_filepath, log_filepath):
+    if not (os.path.exists(extracted_data_filepath) and os.path.isfile(log_filepath)):
+        return False
+    is_up_to_date = os.path.getmtime(extracted_data_filepath) > os.path.getmtime(data_filepath)
+    return is_up_to_date
+
+
+def _iter_articles(data_file, medline_citation_node_path, log_file):
+    events = ET.iterparse(data_file, events=("start", "end"))
+    _, root_node = next(events)
+    for event, node in events:
+        if event == "end" and node.tag == PUBMED_ARTICLE_TAG:
+            medline_citation_node = node.find(medline_citation_node_path)
+            article_metadata = _extract_article_metadata(medline_citation_node, log_file)
+            if _article_is_relevant(article_metadata):
+                yield _get_json_data_for_article(article_metadata)
+            root_node.clear() # Release processed articles so memory use stays flat
+
@@ -0,0 +1,111 @@
+from . import config as cfg
+import hashlib
+import joblib
+import json
+import os
+from scipy import sparse
+import shutil
+import sklearn
+
+
+FEATURES_FILENAME = "features.npz"
+META_FILENAME = "meta.json"
+VECTORIZER_FILENAME = "vectorizer.joblib"
+
+
+class FeatureCache:
+    """On disk cache of TF-IDF feature matrices, and the vectorizers fitted to compute them.
+
+    Each entry is a directory named after its key, which is a hash of everything the features
+    depend on, so changed data or parameters never hit a stale entry. When the cache grows
+    beyond max_size bytes the least recently used entries are evicted. A max_size of 0 disables it.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+    def get(self, key):
+        """Returns (features, vectorizer), where the vectorizer is None if it was not stored, or None for a miss."""
+        entry_path = os.path.join(self.path, key)
+        if self.max_size <= 0 or not os.path.isfile(os.path.join(entry_path, META_FILENAME)):
+            return None
+        features = sparse.load_npz(os.path.join(entry_path, FEATURES_FILENAME))
+        vectorizer_filepath = os.path.join(entry_path, VECTORIZER_FILENAME)
+        vectorizer = joblib.load(vectorizer_filepath) if os.path.isfile(vectorizer_filepath) else None
+        os.utime(entry_path) # Most recently used
+        return features, vectorizer
+
+    def put(self, key, features, vectorizer=None, description=None):
+        if self.max_size <= 0:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        entry_path = os.path.join(self.path, key)
+        tmp_path = entry_path + ".tmp"
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.mkdir(tmp_path)
+
+        sparse.save_npz(os.path.join(tmp_path, FEATURES_FILENAME), features.tocsr(), compressed=False)
+        if vectorizer is not None:
+            joblib.dump(vectorizer, os.path.join(tmp_path, VECTORIZER_FILENAME))
+        # Written last, an entry is only complete if it has a meta file
+        with open(os.path.join(tmp_path, META_FILENAME), "wt", encoding=cfg.ENCODING) as meta_file:
+            json.dump({ "description": description, "shape": list(features.shape), "nnz": int(features.nnz) }, meta_file, indent=4)
+
+        if os.path.isdir(entry_path):
+            shutil.rmtree(entry_path)
+        os.replace(tmp_path, entry_path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            entry_path = os.path.join(self.path, name)
+            if os.path.isdir(entry_path):
+                size = sum(os.path.getsize(os.path.join(entry_path, filename)) for filename in os.listdir(entry_path))
+                entries.append((os.path.getmtime(entry_path), size, entry_path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry_path)
+            total_size -= size
+
+
+def get_fit_transform_key(vectorizer, texts):
+    return get_key("fit_transform", get_vectorizer_fingerprint(vectorizer), get_texts_fingerprint(texts))
+
+
+def get_key(*fingerprints):
+    sha1 = hashlib.sha1()
+    for fingerprint in fingerprints + (sklearn.__version__,): # Pickled vectorizers are tied to the scikit-learn version
+        sha1.update(fingerprint.encode(cfg.ENCODING))
+        sha1.update(b"\0")
+    return sha1.hexdigest()
+
+
+def get_texts_fingerprint(texts):
+    sha1 = hashlib.sha1()
+    for text in texts:
+        encoded_text = text.encode(cfg.ENCODING)
+        sha1.update(len(encoded_text).to_bytes(8, "little")) # So that texts cannot run into each other
+        sha1.update(encoded_text)
+    return sha1.hexdigest()
+
+
+def get_vectorizer_fingerprint(vectorizer):
+    params = sorted(vectorizer.get_params().items())
+    return f"{type(vectorizer).__name__}{params!r}"
+
+
+def transform_cached(cache, transformer, data, transformer_fingerprint, columns):
+    """Returns transformer.transform(data) from the cache if possible, for an already fitted transformer (e.g. a saved model's FeatureUnion)."""
+    key = get_key("transform", transformer_fingerprint, *[get_texts_fingerprint(data[column]) for column in columns])
+    cached = cache.get(key)
+    if cached is not None:
+        features, _ = cached
+    else:
+        features = transformer.transform(data)
+        cache.put(key, features, description=f"{type(transformer).__name__}.transform")
+    return features
@@ -1,19 +1,100 @@
-from datetime import datetime as dt
-import gzip
-import json
+from bisect import bisect_right
+from datetime import date, datetime as dt
+from functools import lru_cache
+import hashlib
+import math
 import os
 import pickle
 
 
+CNN_MODEL_COLUMNS = ["pmid", "title", "abstract", "pub_year", "date_completed", "bmcs_processed_date", "journal_nlmid", "is_indexed", "year_completed"] # year_completed is only present if dates were precomputed
+VOTING_MODEL_COLUMNS = ["pmid", "title", "abstract", "affiliations", "pub_year", "is_indexed"]
+
+DATE_CACHE_SIZE = 65536
+ISO_DATE_FORMAT = "%Y-%m-%d"
+
+class IndexingPeriodIndex:
+    """Precompiled lookup of journal indexing periods.
+
+    An article is in an indexing period if start_year < pub_year < end_year (end_year
+    None means open ended). The periods of each journal are converted to inclusive 
+    year ranges, merged and sorted, so a lookup is a dict access plus a binary search.
+    """
+
+    def __init__(self, indexing_periods):
+        self._year_ranges = {}
+        for nlm_id, periods in indexing_periods.items():
+            year_ranges = []
+            for period in periods:
+                min_year = period["start_year"] + 1
+                max_year = period["end_year"] - 1 if period["end_year"] is not None else math.inf
+                if min_year <= max_year:
+                    year_ranges.append((min_year, max_year))
+            merged_year_ranges = []
+            for min_year, max_year in sorted(year_ranges):
+                if merged_year_ranges and min_year <= merged_year_ranges[-1][1] + 1:
+                    merged_year_ranges[-1] = (merged_year_ranges[-1][0], max(merged_year_ranges[-1][1], max_year))
+                else:
+                    merged_year_ranges.append((min_year, max_year))
+            min_years = [min_year for min_year, _ in merged_year_ranges]
+            max_years = [max_year for _, max_year in merged_year_ranges]
+            self._year_ranges[nlm_id] = (min_years, max_years)
+
+    def contains(self, nlm_id, year):
+        if nlm_id not in self._year_ranges:
+            return False
+        min_years, max_years = self._year_ranges[nlm_id]
+        idx = bisect_right(min_years, year) - 1
+        return idx >= 0 and year <= max_years[idx]
+
+    def get_year_ranges(self, nlm_id, max_year):
+        min_years, max_years = self._year_ranges[nlm_id]
+        year_ranges = [(range_min_year, min(range_max_year, max_year)) for range_min_year, range_max_year in zip(min_years, max_years) if range_min_year <= max_year]
+        return year_ranges
+
+    @property
+    def nlm_ids(self):
+        return sorted(self._year_ranges)
+
+
+def add_precomputed_dates(article, date_format):
+    article["date_completed_ordinal"] = get_date_ordinal(article, "date_completed", date_format)
+    article["bmcs_processed_date_ordinal"] = get_date_ordinal(article, "bmcs_processed_date", date_format)
+    article["year_completed"] = get_year_completed(article, date_format)
+
+
 def create_dir(path):
     if not os.path.exists(path):
         os.mkdir(path)
 
 
-def load_dataset(path, encoding):
-    with gzip.open(path, "rt", encoding=encoding) as file:
-        dataset = json.load(file)
-        return dataset
+def get_date_ordinal(article, field, date_format):
+    ordinal_field = f"{field}_ordinal"
+    if ordinal_field in article:
+        return article[ordinal_field]
+    date_str = article[field]
+    ordinal = parse_date(date_str, date_format).toordinal() if date_str else None
+    return ordinal
+
+
+def get_file_fingerprint(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024*1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_year_completed(article, date_format):
+    if "year_completed" in article:
+        return article["year_completed"]
+    if article["date_completed"]:
+        year_completed = parse_year(article["date_completed"], date_format)
+    elif article["bmcs_processed_date"]:
+        year_completed = parse_year(article["bmcs_processed_date"], date_format)
+    else:
+        year_completed = article["pub_year"]
+    return year_completed
 
 
 def load_indexing_periods(filepath, encoding, is_fully_indexed):
@@ -45,9 +126,21 @@ def load_pickled_object(path):
     return loaded_object
 
 
+@lru_cache(maxsize=DATE_CACHE_SIZE)
 def parse_date(date_str, date_format):
-    date = dt.strptime(date_str, date_format).date()
-    return date
+    if date_format == ISO_DATE_FORMAT:
+        try:
+            return date.fromisoformat(date_str)
+        except ValueError: # E.g. not zero padded, fall back to strptime
+            pass
+    parsed_date = dt.strptime(date_str, date_format).date()
+    return parsed_date
+
+
+def parse_year(date_str, date_format):
+    if date_format == ISO_DATE_FORMAT and len(date_str) == 10:
+        return int(date_str[:4])
+    return parse_date(date_str, date_format).year
 
 
 def preprocess_voting_model_data(data, years=[]):
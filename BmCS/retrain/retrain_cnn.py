@@ -1,21 +1,50 @@
+from .cnn.settings import get_config
 from .cnn import train as train_cnn
 from . import config as cfg
-from .helper import load_dataset, load_pickled_object
+from .dataset_storage import find_dataset_filepath, get_dataset_filepath, iter_dataset, load_dataset
+from .helper import CNN_MODEL_COLUMNS, get_file_fingerprint, load_pickled_object
 import os.path
+import random
+from .token_cache import get_token_cache_filepath, load_or_build_token_cache
 
 
-def run(workdir):
+def run(workdir, jobs=1):
 
     DATA_DIR = workdir
     JOURNAL_ID_DICT_FILEPATH = os.path.join(workdir, cfg.JOURNAL_ID_DICT_FILENAME)
     RUNS_DIR = os.path.join(workdir, cfg.CNN_DATA_DIR)
-    TRAIN_SET_FILEPATH = os.path.join(workdir, cfg.TRAIN_SET_FILENAME)
-    VAL_SET_FILEPATH = os.path.join(workdir, cfg.VAL_SET_FILENAME)
+    TRAIN_SET_FILEPATH = get_dataset_filepath(workdir, cfg.TRAIN_SET_NAME)
+    TRAIN_SET_TOKEN_CACHE_FILEPATH = get_token_cache_filepath(workdir, cfg.TRAIN_SET_NAME)
+    VAL_SET_FILEPATH = get_dataset_filepath(workdir, cfg.VAL_SET_NAME)
+    VAL_SET_TOKEN_CACHE_FILEPATH = get_token_cache_filepath(workdir, cfg.VAL_SET_NAME)
     WORD_INDEX_DICT_FILEPATH = os.path.join(workdir, cfg.WORD_INDEX_DICT_FILENAME)
   
     word_index_lookup = load_pickled_object(WORD_INDEX_DICT_FILEPATH)
     journal_id_lookup = load_pickled_object(JOURNAL_ID_DICT_FILEPATH)
-    train_set = load_dataset(TRAIN_SET_FILEPATH, cfg.ENCODING)
-    val_set = load_dataset(VAL_SET_FILEPATH, cfg.ENCODING)
+    train_set = load_dataset(TRAIN_SET_FILEPATH, CNN_MODEL_COLUMNS)
+    val_set = load_dataset(VAL_SET_FILEPATH, CNN_MODEL_COLUMNS)
 
-    train_cnn.run(DATA_DIR, RUNS_DIR, word_index_lookup, journal_id_lookup, train_set, val_set, cfg.PP_CONFIG)
\ No newline at end of file
+    unknown_word_index = get_config().inputs.preprocessing.unknown_word_index
+    word_index_fingerprint = get_file_fingerprint(WORD_INDEX_DICT_FILEPATH)
+    train_token_cache = load_or_build_token_cache(TRAIN_SET_TOKEN_CACHE_FILEPATH, train_set, word_index_lookup, unknown_word_index, word_index_fingerprint, jobs)
+    val_token_cache = load_or_build_token_cache(VAL_SET_TOKEN_CACHE_FILEPATH, val_set, word_index_lookup, unknown_word_index, word_index_fingerprint, jobs)
+
+    previous_runs_dir, previous_word_index_lookup = None, None
+    if cfg.CNN_WARM_START_WORKDIR:
+        previous_runs_dir = os.path.join(cfg.CNN_WARM_START_WORKDIR, cfg.CNN_DATA_DIR)
+        previous_train_set_filepath = find_dataset_filepath(cfg.CNN_WARM_START_WORKDIR, cfg.TRAIN_SET_NAME)
+        previous_word_index_lookup = load_pickled_object(os.path.join(cfg.CNN_WARM_START_WORKDIR, cfg.WORD_INDEX_DICT_FILENAME))
+        previous_train_set_pmids = set(article["pmid"] for article in iter_dataset(previous_train_set_filepath, ["pmid"]))
+        train_set, train_token_cache = select_warm_start_train_set(train_set, train_token_cache, previous_train_set_pmids, cfg.CNN_WARM_START_REPLAY_FRACTION)
+
+    train_cnn.run(DATA_DIR, RUNS_DIR, word_index_lookup, journal_id_lookup, train_set, val_set, cfg.PP_CONFIG, train_token_cache, val_token_cache, previous_runs_dir, previous_word_index_lookup)
+
+
+def select_warm_start_train_set(train_set, train_token_cache, previous_train_set_pmids, replay_fraction):
+    """Returns the articles the previous model was not trained on, plus a random sample of the others to limit forgetting."""
+    new_indices = [idx for idx, article in enumerate(train_set) if article["pmid"] not in previous_train_set_pmids]
+    seen_indices = [idx for idx, article in enumerate(train_set) if article["pmid"] in previous_train_set_pmids]
+    replay_indices = random.sample(seen_indices, int(round(replay_fraction*len(seen_indices))))
+    indices = sorted(new_indices + replay_indices) # The train set is already shuffled
+    print(f"Warm start train set: {len(new_indices)} new and {len(replay_indices)} replayed articles")
+    return [train_set[idx] for idx in indices], train_token_cache.take(indices)
\ No newline at end of file
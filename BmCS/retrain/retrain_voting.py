@@ -1,8 +1,13 @@
+from ..compact_voting_model import save_compact_voting_model
 from . import config as cfg
-from .helper import create_dir, load_dataset, preprocess_voting_model_data
+from .dataset_storage import get_dataset_filepath, iter_dataset
+from .feature_cache import FeatureCache, get_fit_transform_key
+from .helper import create_dir, preprocess_voting_model_data, VOTING_MODEL_COLUMNS
 from ..item_select import ItemSelector
 import joblib
+from joblib import delayed, effective_n_jobs, Parallel, parallel_backend
 import os.path
+from scipy import sparse
 from sklearn.ensemble import VotingClassifier, RandomForestClassifier
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression, SGDClassifier
@@ -10,22 +15,72 @@ from sklearn.naive_bayes import BernoulliNB
 from sklearn.pipeline import Pipeline, FeatureUnion
 
 
-def get_pipeline(model):
+FEATURE_PIPES = [("titles_pipe", "titles"), ("author_pipe", "author_list"), ("abstract_pipe", "abstract")]
+
+
+def fit_vectorizers(training_data, n_jobs, cache=None):
+    """Fits the TF-IDF vectorizer of each column in parallel and returns them with the stacked training features.
+
+    Columns found in the cache are not fitted again.
+    """
+    results = [None]*len(FEATURE_PIPES)
+    if cache is not None:
+        keys = [get_fit_transform_key(TfidfVectorizer(), training_data[column]) for _, column in FEATURE_PIPES]
+        for idx, key in enumerate(keys):
+            cached = cache.get(key)
+            if cached is not None:
+                features, vectorizer = cached
+                results[idx] = (vectorizer, features)
+    missing_indices = [idx for idx, result in enumerate(results) if result is None]
+
+    n_jobs = max(min(effective_n_jobs(n_jobs), len(missing_indices)), 1)
+    fitted = Parallel(n_jobs=n_jobs)(delayed(_fit_vectorizer)(training_data[FEATURE_PIPES[idx][1]]) for idx in missing_indices)
+    for idx, (vectorizer, features) in zip(missing_indices, fitted):
+        results[idx] = (vectorizer, features)
+        if cache is not None:
+            cache.put(keys[idx], features, vectorizer, description=f"{FEATURE_PIPES[idx][1]} TfidfVectorizer")
+    print(f"TF-IDF features of {len(FEATURE_PIPES) - len(missing_indices)} of {len(FEATURE_PIPES)} columns loaded from the cache")
+
+    vectorizers = [vectorizer for vectorizer, _ in results]
+    features = sparse.hstack([features for _, features in results]).tocsr() # As FeatureUnion stacks them
+    return vectorizers, features
+
+
+def fit_voting_model(training_data, n_jobs, cache=None):
+    vectorizers, features = fit_vectorizers(training_data, n_jobs, cache)
+
+    models = get_models(n_jobs)
+    voting_model = VotingClassifier(estimators=models, voting="soft", n_jobs=len(models))
+    # Threads share the feature matrix, instead of copying it to a process per estimator
+    with parallel_backend("threading", n_jobs=n_jobs):
+        voting_model.fit(features, training_data["labels"])
+
+    pipeline = get_pipeline(voting_model, vectorizers)
+    return pipeline
+
+
+def get_models(n_jobs):
+    models = [
+        ("sgd", SGDClassifier(loss="modified_huber", alpha=.0001, max_iter=1000)),
+        ("lg", LogisticRegression(C=2, random_state=0, max_iter=1000)),
+        ("bnb", BernoulliNB(alpha=.01)),
+        ("rfc", RandomForestClassifier(n_estimators=100, criterion="gini", random_state=0, n_jobs=n_jobs))
+        ]
+    return models
+
+
+def get_pipeline(model, vectorizers=None):
+    """Returns the voting model pipeline, with fitted vectorizers if given."""
+    if vectorizers is None:
+        vectorizers = [TfidfVectorizer() for _ in FEATURE_PIPES]
     pipeline = Pipeline([
         ("union", FeatureUnion(
             transformer_list=[
-                ("titles_pipe", Pipeline([
-                    ("selector", ItemSelector(column="titles")),
-                    ("tfidf", TfidfVectorizer()),
-                ])),
-                ("author_pipe", Pipeline([
-                    ("selector", ItemSelector(column="author_list")),
-                    ("tfidf", TfidfVectorizer()),
-                ])),
-                ("abstract_pipe", Pipeline([
-                    ("selector", ItemSelector(column="abstract")),
-                    ("tfidf", TfidfVectorizer()),
-                ])),
+                (name, Pipeline([
+                    ("selector", ItemSelector(column=column)),
+                    ("tfidf", vectorizer),
+                ]))
+                for (name, column), vectorizer in zip(FEATURE_PIPES, vectorizers)
                 ],
             )),
             ("ensemble", model),
@@ -34,23 +89,23 @@ def get_pipeline(model):
 
 
 def run(workdir):
-    TRAIN_SET_FILEPATH = os.path.join(workdir, cfg.TRAIN_SET_FILENAME)
+    TRAIN_SET_FILEPATH = get_dataset_filepath(workdir, cfg.TRAIN_SET_NAME)
     save_dir = os.path.join(workdir, cfg.VOTING_DATA_DIR)
     create_dir(save_dir)
+    COMPACT_SAVE_DIR = os.path.join(save_dir, cfg.VOTING_COMPACT_MODEL_DIR)
     SAVE_FILEPATH = os.path.join(save_dir, cfg.VOTING_MODEL_FILENAME)
     
-    train_set = load_dataset(TRAIN_SET_FILEPATH, cfg.ENCODING)
+    train_set = iter_dataset(TRAIN_SET_FILEPATH, VOTING_MODEL_COLUMNS)
     training_data = preprocess_voting_model_data(train_set, cfg.VOTING_TRAIN_YEARS)
     print(f"Number training examples: {len(training_data['titles'])}")
 
-    models = [
-        ("sgd", SGDClassifier(loss="modified_huber", alpha=.0001, max_iter=1000)),
-        ("lg", LogisticRegression(C=2, random_state=0, max_iter=1000)),
-        ("bnb", BernoulliNB(alpha=.01)),
-        ("rfc", RandomForestClassifier(n_estimators=100, criterion="gini", random_state=0))
-        ]
+    cache = FeatureCache(os.path.join(workdir, cfg.FEATURE_CACHE_DIR), cfg.FEATURE_CACHE_MAX_SIZE)
+    pipeline = fit_voting_model(training_data, cfg.VOTING_N_JOBS, cache)
+    joblib.dump(pipeline, SAVE_FILEPATH)
+    save_compact_voting_model(pipeline, COMPACT_SAVE_DIR)
+
 
-    voting_model = VotingClassifier(estimators=models, voting="soft", n_jobs=8)
-    pipeline = get_pipeline(voting_model)
-    pipeline.fit(training_data, training_data["labels"])
-    joblib.dump(pipeline, SAVE_FILEPATH)
\ No newline at end of file
+def _fit_vectorizer(texts):
+    vectorizer = TfidfVectorizer()
+    features = vectorizer.fit_transform(texts)
+    return vectorizer, features
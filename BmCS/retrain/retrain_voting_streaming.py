@@ -0,0 +1,125 @@
+from . import config as cfg
+from .dataset_storage import get_dataset_filepath, iter_dataset
+from .helper import create_dir, preprocess_voting_model_data, VOTING_MODEL_COLUMNS
+from .retrain_voting import FEATURE_PIPES
+from ..item_select import ItemSelector
+import joblib
+import numpy as np
+import os.path
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import average_precision_score, f1_score, precision_score, recall_score, roc_auc_score
+from sklearn.naive_bayes import BernoulliNB
+from sklearn.pipeline import Pipeline, FeatureUnion
+from ..soft_voting import SoftVotingClassifier
+import time
+
+
+CLASSES = np.array([False, True])
+
+
+def compute_document_frequencies(train_set_filepath, years, vectorizer):
+    """First pass over the training data: the number of documents and the document frequency of each hashed term, per column."""
+    num_docs = 0
+    document_frequencies = [np.zeros(vectorizer.n_features, dtype=np.int64) for _ in FEATURE_PIPES]
+    for chunk in iter_chunks(train_set_filepath, years):
+        num_docs += len(chunk["labels"])
+        for (_, column), column_document_frequencies in zip(FEATURE_PIPES, document_frequencies):
+            counts = vectorizer.transform(chunk[column]) # Duplicate terms of a document are summed, so every index is a distinct term
+            column_document_frequencies += np.bincount(counts.indices, minlength=vectorizer.n_features)
+    return num_docs, document_frequencies
+
+
+def fit_streaming_voting_model(train_set_filepath, years):
+    vectorizer = HashingVectorizer(n_features=cfg.STREAMING_VOTING_N_FEATURES, alternate_sign=False, norm=None)
+    num_docs, document_frequencies = compute_document_frequencies(train_set_filepath, years, vectorizer)
+    print(f"Number training examples: {num_docs}")
+    tfidf_transformers = [get_tfidf_transformer(num_docs, column_document_frequencies) for column_document_frequencies in document_frequencies]
+
+    sgd_model = SGDClassifier(loss="modified_huber", alpha=.0001, random_state=0)
+    bnb_model = BernoulliNB(alpha=.01)
+    for epoch in range(cfg.STREAMING_VOTING_EPOCHS):
+        for chunk in iter_chunks(train_set_filepath, years):
+            features = sparse.hstack([tfidf_transformer.transform(vectorizer.transform(chunk[column])) for (_, column), tfidf_transformer in zip(FEATURE_PIPES, tfidf_transformers)]).tocsr()
+            sgd_model.partial_fit(features, chunk["labels"], classes=CLASSES)
+            if epoch == 0: # Naive Bayes counts documents, so it sees each of them once
+                bnb_model.partial_fit(features, chunk["labels"], classes=CLASSES)
+        print(f"\rEpoch {epoch + 1}/{cfg.STREAMING_VOTING_EPOCHS}", end="")
+    print()
+
+    voting_model = SoftVotingClassifier(estimators=[("sgd", sgd_model), ("bnb", bnb_model)])
+    pipeline = Pipeline([
+        ("union", FeatureUnion(
+            transformer_list=[
+                (name, Pipeline([
+                    ("selector", ItemSelector(column=column)),
+                    ("hashing", vectorizer),
+                    ("tfidf", tfidf_transformer),
+                ]))
+                for (name, column), tfidf_transformer in zip(FEATURE_PIPES, tfidf_transformers)
+                ],
+            )),
+            ("ensemble", voting_model),
+        ])
+    return pipeline
+
+
+def get_tfidf_transformer(num_docs, document_frequencies):
+    # As TfidfTransformer(smooth_idf=True) would compute it from the whole document-term matrix
+    tfidf_transformer = TfidfTransformer()
+    tfidf_transformer.idf_ = np.log((1 + num_docs)/(1 + document_frequencies)) + 1
+    return tfidf_transformer
+
+
+def iter_chunks(train_set_filepath, years):
+    chunk = []
+    for article in iter_dataset(train_set_filepath, VOTING_MODEL_COLUMNS):
+        chunk.append(article)
+        if len(chunk) == cfg.STREAMING_VOTING_CHUNK_SIZE:
+            training_data = preprocess_voting_model_data(chunk, years)
+            if training_data["labels"]:
+                yield training_data
+            chunk = []
+    training_data = preprocess_voting_model_data(chunk, years)
+    if training_data["labels"]:
+        yield training_data
+
+
+def save_comparison_report(val_data, model_filepaths, save_filepath):
+    """Writes the validation set metrics of each model. Scores are the predicted probability of being indexed."""
+    y_true = np.logical_not(val_data["labels"])
+    lines = [f"{'model':<20}{'precision':>10}{'recall':>10}{'F1':>10}{'ROC AUC':>10}{'avg prec':>10}{'size (MB)':>11}{'pred (s)':>10}"]
+    for name, model_filepath in model_filepaths.items():
+        model = joblib.load(model_filepath)
+        start_time = time.perf_counter()
+        y_score = model.predict_proba(val_data)[:, 0]
+        pred_time = time.perf_counter() - start_time
+        y_pred = y_score >= 0.5
+        lines.append(f"{name:<20}{precision_score(y_true, y_pred):>10.4f}{recall_score(y_true, y_pred):>10.4f}{f1_score(y_true, y_pred):>10.4f}"
+                     f"{roc_auc_score(y_true, y_score):>10.4f}{average_precision_score(y_true, y_score):>10.4f}{os.path.getsize(model_filepath)/2**20:>11.1f}{pred_time:>10.1f}")
+    report = "\n".join(lines)
+    print(report)
+    with open(save_filepath, "wt", encoding=cfg.ENCODING) as report_file:
+        report_file.write(report + "\n")
+
+
+def run(workdir):
+    TRAIN_SET_FILEPATH = get_dataset_filepath(workdir, cfg.TRAIN_SET_NAME)
+    VAL_SET_FILEPATH = get_dataset_filepath(workdir, cfg.VAL_SET_NAME)
+    save_dir = os.path.join(workdir, cfg.VOTING_DATA_DIR)
+    create_dir(save_dir)
+    REPORT_FILEPATH = os.path.join(save_dir, cfg.STREAMING_VOTING_REPORT_FILENAME)
+    SAVE_FILEPATH = os.path.join(save_dir, cfg.STREAMING_VOTING_MODEL_FILENAME)
+    VOTING_MODEL_FILEPATH = os.path.join(save_dir, cfg.VOTING_MODEL_FILENAME)
+
+    start_time = time.perf_counter()
+    pipeline = fit_streaming_voting_model(TRAIN_SET_FILEPATH, cfg.STREAMING_VOTING_TRAIN_YEARS)
+    joblib.dump(pipeline, SAVE_FILEPATH)
+    print(f"Streaming voting model trained in {time.perf_counter() - start_time:.0f}s")
+
+    # Compare with the in memory ensemble, if it has been trained
+    model_filepaths = { "voting": VOTING_MODEL_FILEPATH, "streaming_voting": SAVE_FILEPATH }
+    model_filepaths = { name: filepath for name, filepath in model_filepaths.items() if os.path.isfile(filepath) }
+    val_data = preprocess_voting_model_data(iter_dataset(VAL_SET_FILEPATH, VOTING_MODEL_COLUMNS))
+    save_comparison_report(val_data, model_filepaths, REPORT_FILEPATH)
@@ -1,3 +1,6 @@
+from .cnn.distribute_helper import configure_devices
+from .cnn.settings import get_config
+from . import config as cfg
 from . import create_datasets
 from . import create_journal_id_lookups
 from . import create_word_index_lookups
@@ -7,12 +10,14 @@ from . import download_medline_baseline
 from . import extract_medline_data
 from . import retrain_cnn
 from . import retrain_voting
+from . import retrain_voting_streaming
 
 # import os
 # os.environ["CUDA_VISIBLE_DEVICES"] = "1"
 
 
-def run(workdir, use_eutils):
+def run(workdir, use_eutils, jobs=1):
+    configure_devices(get_config().train.distribute) # Before any step initializes TensorFlow
     if use_eutils:
         raise NotImplementedError("Do not use - as error handling not implemented correctly, may only retrieve 10k records per journal.")
         print("Downloading MEDLINE data from eutils...")
@@ -21,16 +26,19 @@ def run(workdir, use_eutils):
         print("Downloading MEDLINE baseline...")
         num_xml_files = download_medline_baseline.run(workdir)
     print("Extracting MEDLINE data...")
-    extract_medline_data.run(workdir, num_xml_files)
+    extract_medline_data.run(workdir, num_xml_files, jobs)
     print("Creating datasets...")
     create_datasets.run(workdir, num_xml_files)
     print("Create word index lookups...")
-    create_word_index_lookups.run(workdir)
+    create_word_index_lookups.run(workdir, jobs)
     print("Create journal id lookups...")
     create_journal_id_lookups.run(workdir)
     print("Retraining voting model...")
     retrain_voting.run(workdir)
+    if cfg.TRAIN_STREAMING_VOTING_MODEL:
+        print("Retraining streaming voting model...")
+        retrain_voting_streaming.run(workdir)
     print("Retraining CNN model...")
-    retrain_cnn.run(workdir)
+    retrain_cnn.run(workdir, jobs)
     # print("Finding optimum thresholds...") # Note: Updated system design uses a single threshold
     # determine_optimum_thresholds.run(workdir)
\ No newline at end of file
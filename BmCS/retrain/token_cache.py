@@ -0,0 +1,160 @@
+from concurrent.futures import ProcessPoolExecutor
+from . import config as cfg
+import json
+from nltk.tokenize import word_tokenize
+import numpy as np
+import os
+import shutil
+
+
+IDS_FILENAME = "ids.npy"
+META_FILENAME = "meta.json"
+OFFSETS_FILENAME = "offsets.npy"
+PMIDS_FILENAME = "pmids.npy"
+SHARD_SIZE = 10000
+
+
+class TokenCache:
+    """Word indices of the titles and abstracts of a dataset.
+
+    The indices of all articles are stored in one flat int32 array. Title i is
+    ids[offsets[2*i]:offsets[2*i + 1]] and abstract i is ids[offsets[2*i + 1]:offsets[2*i + 2]].
+    The arrays are memory mapped when loaded from disk.
+    """
+
+    def __init__(self, ids, offsets, pmids):
+        self.ids = ids
+        self.offsets = offsets
+        self.pmids = pmids
+
+    def __len__(self):
+        return len(self.pmids)
+
+    def get_abstract(self, idx):
+        return self.ids[self.offsets[2*idx + 1]:self.offsets[2*idx + 2]]
+
+    def get_title(self, idx):
+        return self.ids[self.offsets[2*idx]:self.offsets[2*idx + 1]]
+
+    def take(self, indices):
+        """Returns an in memory cache of the given articles, in the given order."""
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = np.asarray(self.offsets[2*indices])
+        title_lengths = np.asarray(self.offsets[2*indices + 1]) - starts
+        lengths = np.asarray(self.offsets[2*indices + 2]) - starts # The abstract follows the title
+        article_starts = np.cumsum(lengths) - lengths
+        positions = np.arange(lengths.sum()) - np.repeat(article_starts, lengths) + np.repeat(starts, lengths)
+        offsets = np.zeros(2*len(indices) + 1, dtype=np.int64)
+        offsets[2::2] = np.cumsum(lengths)
+        offsets[1::2] = offsets[:-1:2] + title_lengths
+        return TokenCache(np.asarray(self.ids[positions]), offsets, np.asarray(self.pmids[indices]))
+
+
+class TokenizedShard:
+    """Tokens of a shard of articles, encoded with a shard local vocabulary."""
+
+    def __init__(self, tokens, ids, lengths):
+        self.tokens = tokens
+        self.ids = ids
+        self.lengths = lengths
+
+    def get_token_counts(self):
+        counts = np.bincount(self.ids, minlength=len(self.tokens))
+        return dict(zip(self.tokens, counts.tolist()))
+
+    def get_word_indices(self, word_index_lookup, unknown_word_index):
+        local_to_word_index = np.array([word_index_lookup.get(token, unknown_word_index) for token in self.tokens], dtype=np.int32)
+        word_indices = local_to_word_index[self.ids]
+        return word_indices
+
+
+def build_token_cache(path, dataset, word_index_lookup, unknown_word_index, fingerprint, jobs=1):
+    shards = tokenize_dataset(dataset, jobs)
+    pmids = [article["pmid"] for article in dataset]
+    save_token_cache(path, pmids, shards, word_index_lookup, unknown_word_index, fingerprint)
+
+
+def get_token_cache_filepath(dirpath, name):
+    return os.path.join(dirpath, name + cfg.TOKEN_CACHE_EXTENSION)
+
+
+def load_or_build_token_cache(path, dataset, word_index_lookup, unknown_word_index, fingerprint, jobs=1):
+    token_cache = load_token_cache(path, unknown_word_index, fingerprint)
+    if token_cache is None or not np.array_equal(token_cache.pmids, [article["pmid"] for article in dataset]):
+        build_token_cache(path, dataset, word_index_lookup, unknown_word_index, fingerprint, jobs)
+        token_cache = load_token_cache(path, unknown_word_index, fingerprint)
+    return token_cache
+
+
+def load_token_cache(path, unknown_word_index, fingerprint):
+    meta_filepath = os.path.join(path, META_FILENAME)
+    if not os.path.isfile(meta_filepath):
+        return None
+    with open(meta_filepath, "rt", encoding=cfg.ENCODING) as meta_file:
+        meta = json.load(meta_file)
+    if meta["word_index_fingerprint"] != fingerprint or meta.get("unknown_word_index") != unknown_word_index: # Built with a different word index lookup or unknown word index
+        return None
+    ids = np.load(os.path.join(path, IDS_FILENAME), mmap_mode="r")
+    offsets = np.load(os.path.join(path, OFFSETS_FILENAME), mmap_mode="r")
+    pmids = np.load(os.path.join(path, PMIDS_FILENAME), mmap_mode="r")
+    return TokenCache(ids, offsets, pmids)
+
+
+def save_token_cache(path, pmids, shards, word_index_lookup, unknown_word_index, fingerprint):
+    tmp_path = path + ".tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.mkdir(tmp_path)
+
+    ids = np.concatenate([shard.get_word_indices(word_index_lookup, unknown_word_index) for shard in shards] or [np.empty(0, dtype=np.int32)])
+    lengths = np.concatenate([shard.lengths for shard in shards] or [np.empty(0, dtype=np.int64)])
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    np.save(os.path.join(tmp_path, IDS_FILENAME), ids)
+    np.save(os.path.join(tmp_path, OFFSETS_FILENAME), offsets)
+    np.save(os.path.join(tmp_path, PMIDS_FILENAME), np.array(pmids, dtype=np.int64))
+    with open(os.path.join(tmp_path, META_FILENAME), "wt", encoding=cfg.ENCODING) as meta_file:
+        json.dump({ "num_articles": len(pmids), "word_index_fingerprint": fingerprint, "unknown_word_index": unknown_word_index }, meta_file, indent=4)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def tokenize(text):
+    text = text.lower()
+    tokens = word_tokenize(text)
+    return tokens
+
+
+def tokenize_dataset(dataset, jobs=1):
+    num_articles = len(dataset)
+    shard_texts = [[(article["title"], article["abstract"]) for article in dataset[start:start + SHARD_SIZE]] for start in range(0, num_articles, SHARD_SIZE)]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            shards = _collect_shards(executor.map(tokenize_texts, shard_texts), num_articles)
+    else:
+        shards = _collect_shards(map(tokenize_texts, shard_texts), num_articles)
+    print(f"{num_articles}/{num_articles}")
+    return shards
+
+
+def tokenize_texts(texts):
+    local_ids = {}
+    ids = []
+    lengths = []
+    for title, abstract in texts:
+        for text in (title, abstract):
+            tokens = tokenize(text)
+            ids.extend(local_ids.setdefault(token, len(local_ids)) for token in tokens)
+            lengths.append(len(tokens))
+    return TokenizedShard(list(local_ids), np.array(ids, dtype=np.int32), np.array(lengths, dtype=np.int64))
+
+
+def _collect_shards(shards, num_articles):
+    collected_shards = []
+    for idx, shard in enumerate(shards):
+        print(f"{idx*SHARD_SIZE}/{num_articles}", end="\r")
+        collected_shards.append(shard)
+    return collected_shards
@@ -0,0 +1,30 @@
+from sklearn.base import BaseEstimator, ClassifierMixin
+import numpy as np
+
+class SoftVotingClassifier(BaseEstimator, ClassifierMixin):
+    """Averages the predicted probabilities of classifiers, as VotingClassifier(voting="soft") does.
+
+    Unlike VotingClassifier, the estimators can be fitted beforehand (e.g. with partial_fit),
+    and must all have the same classes_.
+    """
+
+    def __init__(self, estimators):
+        self.estimators = estimators
+
+    @property
+    def classes_(self):
+        return self.estimators[0][1].classes_
+
+    def __sklearn_is_fitted__(self):
+        return all(hasattr(estimator, "classes_") for _, estimator in self.estimators)
+
+    def fit(self, X, y):
+        for _, estimator in self.estimators:
+            estimator.fit(X, y)
+        return self
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def predict_proba(self, X):
+        return np.mean([estimator.predict_proba(X) for _, estimator in self.estimators], axis=0)
@@ -0,0 +1,136 @@
+"""Compares CNN training on fixed length batches with length bucketed batches.
+
+Reports training throughput (examples/sec) and validation F1 at a 0.5 threshold for both
+input paths. With --workdir the train and validation sets of a retraining working directory
+are used (after create_word_index_lookups has run), otherwise a synthetic dataset with
+a realistic spread of abstract lengths is generated.
+
+Run from the repository root:
+    python scripts/benchmark_bucketing.py --workdir /path/to/workdir --max-train-examples 100000 --epochs 1
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from BmCS.retrain import config as cfg
+from BmCS.retrain.cnn.data_helper import DataGenerator, set_vocab_size
+from BmCS.retrain.cnn.model import Model
+from BmCS.retrain.cnn.settings import get_config
+from BmCS.retrain.dataset_storage import get_dataset_filepath, load_dataset
+from BmCS.retrain.helper import CNN_MODEL_COLUMNS, get_file_fingerprint, load_pickled_object
+from BmCS.retrain.token_cache import build_token_cache, get_token_cache_filepath, load_or_build_token_cache, load_token_cache, TokenCache
+
+
+SIGNAL_WORD_INDEX = 1000
+
+
+def compute_fscore(labels, scores, threshold=0.5):
+    predicted = scores > threshold
+    true_positives = np.sum(predicted & (labels > 0))
+    denominator = np.sum(predicted) + np.sum(labels > 0)
+    return 2*true_positives/denominator if denominator > 0 else 0.
+
+
+def create_synthetic_data(num_articles, vocab_size, cache_dir, rng):
+    # Word w<idx> has word index idx
+    word_index_lookup = { f"w{idx}": idx for idx in range(2, vocab_size) }
+    data_set = []
+    for idx in range(num_articles):
+        abstract_length = int(min(rng.gamma(4., 50.), 1000))
+        abstract = rng.integers(2, vocab_size, size=abstract_length)
+        is_indexed = rng.random() < 0.5
+        if is_indexed and abstract_length > 0: # Make the label learnable
+            abstract[rng.integers(0, abstract_length)] = SIGNAL_WORD_INDEX
+        title = rng.integers(2, vocab_size, size=rng.integers(5, 25))
+        data_set.append({ "pmid": idx + 1,
+                          "title": " ".join(f"w{word_index}" for word_index in title),
+                          "abstract": " ".join(f"w{word_index}" for word_index in abstract),
+                          "pub_year": 2015, "year_completed": 2016, "journal_nlmid": "", "is_indexed": is_indexed })
+    train_set, val_set = data_set[:int(0.9*num_articles)], data_set[int(0.9*num_articles):]
+    train_cache_path = os.path.join(cache_dir, "train" + cfg.TOKEN_CACHE_EXTENSION)
+    val_cache_path = os.path.join(cache_dir, "val" + cfg.TOKEN_CACHE_EXTENSION)
+    unknown_word_index = get_config().inputs.preprocessing.unknown_word_index
+    build_token_cache(train_cache_path, train_set, word_index_lookup, unknown_word_index, "synthetic")
+    build_token_cache(val_cache_path, val_set, word_index_lookup, unknown_word_index, "synthetic")
+    return train_set, val_set, word_index_lookup, {}, load_token_cache(train_cache_path, unknown_word_index, "synthetic"), load_token_cache(val_cache_path, unknown_word_index, "synthetic")
+
+
+def load_workdir_data(workdir, max_train_examples):
+    JOURNAL_ID_DICT_FILEPATH = os.path.join(workdir, cfg.JOURNAL_ID_DICT_FILENAME)
+    WORD_INDEX_DICT_FILEPATH = os.path.join(workdir, cfg.WORD_INDEX_DICT_FILENAME)
+
+    word_index_lookup = load_pickled_object(WORD_INDEX_DICT_FILEPATH)
+    journal_id_lookup = load_pickled_object(JOURNAL_ID_DICT_FILEPATH)
+    unknown_word_index = get_config().inputs.preprocessing.unknown_word_index
+    word_index_fingerprint = get_file_fingerprint(WORD_INDEX_DICT_FILEPATH)
+    train_set = load_dataset(get_dataset_filepath(workdir, cfg.TRAIN_SET_NAME), CNN_MODEL_COLUMNS)
+    val_set = load_dataset(get_dataset_filepath(workdir, cfg.VAL_SET_NAME), CNN_MODEL_COLUMNS)
+    train_token_cache = load_or_build_token_cache(get_token_cache_filepath(workdir, cfg.TRAIN_SET_NAME), train_set, word_index_lookup, unknown_word_index, word_index_fingerprint)
+    val_token_cache = load_or_build_token_cache(get_token_cache_filepath(workdir, cfg.VAL_SET_NAME), val_set, word_index_lookup, unknown_word_index, word_index_fingerprint)
+    if max_train_examples < len(train_set): # The train set is already shuffled
+        train_set = train_set[:max_train_examples]
+        train_token_cache = TokenCache(train_token_cache.ids, train_token_cache.offsets[:2*max_train_examples + 1], train_token_cache.pmids[:max_train_examples])
+    return train_set, val_set, word_index_lookup, journal_id_lookup, train_token_cache, val_token_cache
+
+
+def run_variant(bucket_abstracts, args, data):
+    train_set, val_set, word_index_lookup, journal_id_lookup, train_token_cache, val_token_cache = data
+
+    config = get_config()
+    pp_config = config.inputs.preprocessing
+    pp_config.min_pub_year = cfg.PP_CONFIG["min_pub_year"]
+    pp_config.max_pub_year = cfg.PP_CONFIG["max_pub_year"]
+    pp_config.min_year_completed = cfg.PP_CONFIG["min_year_indexed"]
+    pp_config.max_year_completed = cfg.PP_CONFIG["max_year_indexed"]
+    pp_config.vocab_size = min(args.vocab_size, len(word_index_lookup) + 2)
+    pp_config.bucket_abstracts = bucket_abstracts
+    model_config = config.model
+    model_config.num_journals = len(journal_id_lookup) + 1
+
+    word_index_lookup = set_vocab_size(word_index_lookup, pp_config.vocab_size)
+    train_gen = DataGenerator(pp_config, word_index_lookup, journal_id_lookup, train_set, args.batch_size, token_cache=train_token_cache, shuffle=True)
+    val_gen = DataGenerator(pp_config, word_index_lookup, journal_id_lookup, val_set, args.batch_size, token_cache=val_token_cache)
+    padded_words = sum(train_gen[idx][0]["abstract_input"].size for idx in range(len(train_gen)))
+
+    model = Model()
+    model.build(model_config)
+    start_time = time.perf_counter()
+    model._model.fit(train_gen, epochs=args.epochs, verbose=0, shuffle=True)
+    elapsed_time = time.perf_counter() - start_time
+
+    _, labels, scores = model.predict_arrays(config.pred_config, val_gen)
+    return { "examples_per_sec": args.epochs*len(train_set)/elapsed_time,
+             "abstract_words_per_example": padded_words/len(train_set),
+             "val_fscore": compute_fscore(labels, scores) }
+
+
+def run(args):
+    if args.workdir:
+        data = load_workdir_data(args.workdir, args.max_train_examples)
+        results = { name: run_variant(bucket_abstracts, args, data) for name, bucket_abstracts in [("fixed", False), ("bucketed", True)] }
+    else:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            data = create_synthetic_data(args.num_synthetic_articles, args.vocab_size, cache_dir, np.random.default_rng(0))
+            results = { name: run_variant(bucket_abstracts, args, data) for name, bucket_abstracts in [("fixed", False), ("bucketed", True)] }
+
+    print(f"{'input path':<12}{'examples/sec':>15}{'abstract words/example':>25}{'val F1':>10}")
+    for name, result in results.items():
+        print(f"{name:<12}{result['examples_per_sec']:>15.1f}{result['abstract_words_per_example']:>25.1f}{result['val_fscore']:>10.4f}")
+    print(f"Speedup: {results['bucketed']['examples_per_sec']/results['fixed']['examples_per_sec']:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark length bucketed batching against fixed length batches.")
+    parser.add_argument("--workdir", help="Retraining working directory. A synthetic dataset is used if omitted.")
+    parser.add_argument("--max-train-examples", type=int, default=100000)
+    parser.add_argument("--num-synthetic-articles", type=int, default=20000)
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--vocab-size", type=int, default=400000)
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,173 @@
+"""Compares CPU inference of the restored keras CNN with the exported inference models.
+
+For every path the cold start (load plus first prediction), the median single article
+latency and the batch throughput are reported. With --runs-dir the model.json, checkpoint
+and export directory of a training run are used (e.g. /path/to/workdir/cnn_model), otherwise
+a freshly initialized model is saved and exported to a temporary directory first.
+
+Run from the repository root:
+    python scripts/benchmark_cnn_inference.py --runs-dir /path/to/workdir/cnn_model
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from BmCS.retrain import config as cfg
+from BmCS.retrain.cnn.model import Model
+from BmCS.retrain.cnn.settings import get_config
+import tensorflow as tf
+
+
+INPUT_NAMES = ["title_input", "abstract_input", "pub_year_input", "year_completed_input"]
+
+
+class KerasPredictor:
+
+    def __init__(self, config, runs_dir):
+        self._model = Model()
+        self._model.restore(config.pred_config, runs_dir)
+
+    def predict(self, batch_x):
+        return self._model._model.predict_on_batch(batch_x)
+
+
+class OnnxPredictor:
+
+    def __init__(self, path):
+        import onnxruntime
+        self._session = onnxruntime.InferenceSession(path)
+
+    def predict(self, batch_x):
+        return self._session.run(None, { node.name: batch_x[node.name] for node in self._session.get_inputs() })[0]
+
+
+class SavedModelPredictor:
+
+    def __init__(self, path):
+        self._serve = tf.saved_model.load(path).signatures["serving_default"]
+
+    def predict(self, batch_x):
+        outputs = self._serve(**{ name: tf.constant(values) for name, values in batch_x.items() })
+        return next(iter(outputs.values())).numpy()
+
+
+class TFLitePredictor:
+
+    def __init__(self, path):
+        self._interpreter = tf.lite.Interpreter(model_path=path)
+        self._input_details = { _get_input_name(detail["name"]): detail for detail in self._interpreter.get_input_details() }
+        self._batch_size = None
+
+    def predict(self, batch_x):
+        batch_size = len(batch_x["title_input"])
+        if batch_size != self._batch_size:
+            for name, detail in self._input_details.items():
+                self._interpreter.resize_tensor_input(detail["index"], batch_x[name].shape)
+            self._interpreter.allocate_tensors()
+            self._batch_size = batch_size
+        for name, detail in self._input_details.items():
+            self._interpreter.set_tensor(detail["index"], batch_x[name])
+        self._interpreter.invoke()
+        return self._interpreter.get_tensor(self._interpreter.get_output_details()[0]["index"])
+
+
+def benchmark(create_predictor, single_x, batch_x, args):
+    start_time = time.perf_counter()
+    predictor = create_predictor()
+    predictor.predict(single_x)
+    cold_start = time.perf_counter() - start_time
+
+    latencies = []
+    for _ in range(args.num_single_runs):
+        start_time = time.perf_counter()
+        predictor.predict(single_x)
+        latencies.append(time.perf_counter() - start_time)
+
+    predictor.predict(batch_x)
+    start_time = time.perf_counter()
+    for _ in range(args.num_batch_runs):
+        predictor.predict(batch_x)
+    throughput = args.num_batch_runs*args.batch_size/(time.perf_counter() - start_time)
+    return cold_start, np.median(latencies), throughput
+
+
+def create_inputs(model_config, batch_size, rng):
+    batch_x = { "title_input": rng.integers(0, model_config.vocab_size, size=(batch_size, model_config.title_max_words)),
+                "abstract_input": rng.integers(0, model_config.vocab_size, size=(batch_size, model_config.abstract_max_words)),
+                "pub_year_input": rng.integers(0, 2, size=(batch_size, model_config.num_pub_year_time_periods)),
+                "year_completed_input": rng.integers(0, 2, size=(batch_size, model_config.num_year_completed_time_periods)) }
+    return { name: values.astype(np.float32) for name, values in batch_x.items() }
+
+
+def create_synthetic_run(config, runs_dir):
+    model = Model()
+    model.build(config.model)
+    checkpoint_dir = os.path.join(runs_dir, config.pred_config.model_checkpoint_dir)
+    os.makedirs(checkpoint_dir)
+    with open(os.path.join(runs_dir, config.pred_config.model_json_filename), "wt", encoding=config.pred_config.encoding) as model_json_file:
+        model_json_file.write(model._model.to_json(indent=4))
+    model._model.save_weights(os.path.join(checkpoint_dir, config.pred_config.model_checkpoint_filename))
+    model.export(config, runs_dir)
+
+
+def get_config_for_benchmark(args):
+    config = get_config()
+    pp_config = config.inputs.preprocessing
+    pp_config.min_pub_year = cfg.PP_CONFIG["min_pub_year"]
+    pp_config.max_pub_year = cfg.PP_CONFIG["max_pub_year"]
+    pp_config.min_year_completed = cfg.PP_CONFIG["min_year_indexed"]
+    pp_config.max_year_completed = cfg.PP_CONFIG["max_year_indexed"]
+    pp_config.vocab_size = args.vocab_size
+    config.model.num_journals = 1
+    config.train.export.tflite = True
+    return config
+
+
+def run(args):
+    config = get_config_for_benchmark(args)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        runs_dir = args.runs_dir
+        if not runs_dir:
+            runs_dir = tmp_dir
+            create_synthetic_run(config, runs_dir)
+
+        export_config = config.train.export
+        export_dir = os.path.join(runs_dir, export_config.dir)
+        predictors = [("keras", lambda: KerasPredictor(config, runs_dir)),
+                      ("saved_model", lambda: SavedModelPredictor(os.path.join(export_dir, export_config.saved_model_dir)))]
+        if os.path.isfile(os.path.join(export_dir, export_config.tflite_filename)):
+            predictors.append(("tflite", lambda: TFLitePredictor(os.path.join(export_dir, export_config.tflite_filename))))
+        if os.path.isfile(os.path.join(export_dir, export_config.onnx_filename)):
+            predictors.append(("onnx", lambda: OnnxPredictor(os.path.join(export_dir, export_config.onnx_filename))))
+
+        rng = np.random.default_rng(0)
+        single_x = create_inputs(config.model, 1, rng)
+        batch_x = create_inputs(config.model, args.batch_size, rng)
+        print(f"{'path':<14}{'cold start (s)':>16}{'latency (ms)':>14}{'examples/sec':>14}")
+        for name, create_predictor in predictors:
+            cold_start, latency, throughput = benchmark(create_predictor, single_x, batch_x, args)
+            print(f"{name:<14}{cold_start:>16.2f}{latency*1000:>14.2f}{throughput:>14.1f}")
+
+
+def _get_input_name(tensor_name):
+    # TFLite input tensors are named e.g. serving_default_title_input:0
+    for name in INPUT_NAMES:
+        if name in tensor_name:
+            return name
+    raise ValueError(f"Unknown input: {tensor_name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CNN inference of the keras model and the exported models.")
+    parser.add_argument("--runs-dir", help="CNN runs directory with model.json, checkpoints and export. A synthetic model is used if omitted.")
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--num-single-runs", type=int, default=100)
+    parser.add_argument("--num-batch-runs", type=int, default=10)
+    parser.add_argument("--vocab-size", type=int, default=400000)
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,97 @@
+"""Compares CNN training throughput and peak memory of the float32, mixed precision and XLA variants.
+
+Each variant is trained on synthetic batches in its own process, because peak memory can only
+be measured per process.
+
+Run from the repository root:
+    python scripts/benchmark_cnn_training.py --steps 50 --batch-size 128
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+VARIANTS = { "float32": (False, False),
+             "mixed_precision": (True, False),
+             "jit_compile": (False, True),
+             "mixed_precision+jit_compile": (True, True) }
+
+
+def create_batch(model_config, batch_size, rng):
+    import numpy as np
+    batch_x = { "title_input": rng.integers(0, model_config.vocab_size, size=(batch_size, model_config.title_max_words), dtype=np.int32),
+                "abstract_input": rng.integers(0, model_config.vocab_size, size=(batch_size, model_config.abstract_max_words), dtype=np.int32),
+                "pub_year_input": rng.integers(0, 2, size=(batch_size, model_config.num_pub_year_time_periods), dtype=np.int32),
+                "year_completed_input": rng.integers(0, 2, size=(batch_size, model_config.num_year_completed_time_periods), dtype=np.int32) }
+    batch_y = rng.integers(0, 2, size=(batch_size, 1)).astype(np.float32)
+    return batch_x, batch_y
+
+
+def run_variant(variant, args):
+    import numpy as np
+    from BmCS.retrain.cnn.model import Model
+    from BmCS.retrain.cnn.settings import get_config
+
+    config = get_config()
+    pp_config = config.inputs.preprocessing
+    pp_config.min_pub_year = 1809
+    pp_config.max_pub_year = 2021
+    pp_config.min_year_completed = 1965
+    pp_config.max_year_completed = 2021
+    pp_config.vocab_size = args.vocab_size
+    model_config = config.model
+    model_config.num_journals = 1
+    model_config.mixed_precision, model_config.jit_compile = VARIANTS[variant]
+
+    model = Model()
+    model.build(model_config)
+
+    rng = np.random.default_rng(0)
+    batches = [create_batch(model_config, args.batch_size, rng) for _ in range(args.num_distinct_batches)]
+    for step in range(args.warmup_steps):
+        model._model.train_on_batch(*batches[step % len(batches)])
+
+    start_time = time.perf_counter()
+    for step in range(args.steps):
+        model._model.train_on_batch(*batches[step % len(batches)])
+    elapsed_time = time.perf_counter() - start_time
+
+    result = { "variant": variant,
+               "examples_per_sec": args.steps*args.batch_size/elapsed_time,
+               "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 }
+    print(json.dumps(result))
+
+
+def run(args):
+    results = []
+    for variant in args.variants:
+        command = [sys.executable, os.path.abspath(__file__), "--variant", variant, "--steps", str(args.steps), "--warmup-steps", str(args.warmup_steps),
+                   "--batch-size", str(args.batch_size), "--vocab-size", str(args.vocab_size), "--num-distinct-batches", str(args.num_distinct_batches)]
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    baseline = results[0]["examples_per_sec"]
+    print(f"{'variant':<30}{'examples/sec':>15}{'speedup':>10}{'peak RSS (MB)':>16}")
+    for result in results:
+        print(f"{result['variant']:<30}{result['examples_per_sec']:>15.1f}{result['examples_per_sec']/baseline:>10.2f}{result['peak_rss_mb']:>16.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CNN training variants on synthetic data.")
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--variant", choices=list(VARIANTS), help=argparse.SUPPRESS)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--warmup-steps", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--vocab-size", type=int, default=400000)
+    parser.add_argument("--num-distinct-batches", type=int, default=10)
+    args = parser.parse_args()
+    if args.variant:
+        run_variant(args.variant, args)
+    else:
+        run(args)
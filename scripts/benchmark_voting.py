@@ -0,0 +1,126 @@
+"""Reports the fit time and peak memory of each step of voting model training.
+
+The TF-IDF features are computed once and every estimator of the ensemble is then fitted
+on them in turn, with --n-jobs cores. With --baseline the original pipeline (serial
+FeatureUnion, one process per estimator, single core random forest) is also fitted end to end.
+With --workdir the train set of a retraining working directory is used, otherwise a synthetic
+dataset is generated. Peak memory is the resident set size of this process (Linux only).
+
+Run from the repository root:
+    python scripts/benchmark_voting.py --workdir /path/to/workdir --max-examples 200000 --baseline
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from joblib import parallel_backend
+import numpy as np
+from BmCS.retrain import config as cfg
+from BmCS.retrain.dataset_storage import get_dataset_filepath, iter_dataset
+from BmCS.retrain.helper import preprocess_voting_model_data, VOTING_MODEL_COLUMNS
+from BmCS.retrain.retrain_voting import fit_vectorizers, get_models, get_pipeline
+from sklearn.ensemble import VotingClassifier
+
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class PeakMemorySampler:
+
+    def __init__(self, interval=0.01):
+        self._interval = interval
+        self._stopped = threading.Event()
+        self.peak = 0
+
+    def __enter__(self):
+        self.peak = _get_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stopped.set()
+        self._thread.join()
+        self.peak = max(self.peak, _get_rss())
+
+    def _sample(self):
+        while not self._stopped.wait(self._interval):
+            self.peak = max(self.peak, _get_rss())
+
+
+def create_synthetic_data(num_articles, rng):
+    vocab = np.array([f"w{idx}" for idx in range(50000)])
+    word_probs = 1./np.arange(1, len(vocab) + 1) # Zipf
+    word_probs /= word_probs.sum()
+    training_data = { "titles" : [], "abstract" : [], "author_list" : [], "labels": [] }
+    for _ in range(num_articles):
+        label = bool(rng.random() < 0.3)
+        abstract = rng.choice(vocab, size=int(min(rng.gamma(4., 50.), 1000)), p=word_probs)
+        if label and len(abstract) > 0: # Make the label learnable
+            abstract[0] = "signal"
+        training_data["titles"].append(" ".join(rng.choice(vocab, size=rng.integers(5, 25), p=word_probs)))
+        training_data["abstract"].append(" ".join(abstract))
+        training_data["author_list"].append(" ".join(rng.choice(vocab[-5000:], size=rng.integers(0, 20))))
+        training_data["labels"].append(label)
+    return training_data
+
+
+def load_workdir_data(workdir, max_examples):
+    train_set = iter_dataset(get_dataset_filepath(workdir, cfg.TRAIN_SET_NAME), VOTING_MODEL_COLUMNS)
+    training_data = preprocess_voting_model_data(train_set, cfg.VOTING_TRAIN_YEARS)
+    return { name: values[:max_examples] for name, values in training_data.items() }
+
+
+def measure(fit):
+    with PeakMemorySampler() as sampler:
+        start_time = time.perf_counter()
+        result = fit()
+        elapsed_time = time.perf_counter() - start_time
+    return result, elapsed_time, sampler.peak
+
+
+def run(args):
+    training_data = load_workdir_data(args.workdir, args.max_examples) if args.workdir else create_synthetic_data(args.num_synthetic_articles, np.random.default_rng(0))
+    labels = training_data["labels"]
+    print(f"Number training examples: {len(labels)}")
+
+    results = []
+    (_, features), elapsed_time, peak = measure(lambda: fit_vectorizers(training_data, args.n_jobs))
+    results.append(("tfidf", elapsed_time, peak))
+    print(f"Features: {features.shape[0]} x {features.shape[1]}, {features.nnz} non-zeros")
+    for name, model in get_models(args.n_jobs):
+        with parallel_backend("threading", n_jobs=args.n_jobs):
+            _, elapsed_time, peak = measure(lambda: model.fit(features, labels))
+        results.append((name, elapsed_time, peak))
+    del features
+
+    if args.baseline:
+        models = get_models(None)
+        baseline_pipeline = get_pipeline(VotingClassifier(estimators=models, voting="soft", n_jobs=8))
+        _, elapsed_time, peak = measure(lambda: baseline_pipeline.fit(training_data, labels))
+        results.append(("baseline", elapsed_time, peak))
+
+    print(f"{'step':<10}{'fit time (s)':>14}{'peak RSS (MB)':>15}")
+    for name, elapsed_time, peak in results:
+        print(f"{name:<10}{elapsed_time:>14.1f}{peak/2**20:>15.0f}")
+    print(f"Total (estimators fitted one at a time): {sum(elapsed_time for name, elapsed_time, _ in results if name != 'baseline'):.1f} s")
+
+
+def _get_rss():
+    with open("/proc/self/statm") as statm_file:
+        return int(statm_file.read().split()[1])*PAGE_SIZE
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark voting model training.")
+    parser.add_argument("--workdir", help="Retraining working directory. A synthetic dataset is used if omitted.")
+    parser.add_argument("--max-examples", type=int, default=200000)
+    parser.add_argument("--num-synthetic-articles", type=int, default=20000)
+    parser.add_argument("--n-jobs", type=int, default=cfg.VOTING_N_JOBS)
+    parser.add_argument("--baseline", action="store_true", help="Also fit the original pipeline, for comparison. Memory of its worker processes is not included.")
+    args = parser.parse_args()
+    run(args)
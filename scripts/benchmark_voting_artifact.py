@@ -0,0 +1,85 @@
+"""Compares the joblib voting model with its compact copy (BmCS/compact_voting_model.py).
+
+Reports the size on disk, the cold load time and the resident memory after loading of each
+artifact, every load in a fresh process, and checks that predict_proba gives identical output.
+With --model-path an existing voting_model.joblib is used, otherwise a model is trained on
+synthetic data first. Memory is the resident set size of the loading process (Linux only).
+
+Run from the repository root:
+    python scripts/benchmark_voting_artifact.py --model-path /path/to/workdir/voting_model/voting_model.joblib
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_voting import create_synthetic_data
+from BmCS.compact_voting_model import load_compact_voting_model, save_compact_voting_model
+import joblib
+import numpy as np
+
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def get_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, filename)) for filename in os.listdir(path))
+
+
+def load(kind, path):
+    return joblib.load(path) if kind == "joblib" else load_compact_voting_model(path)
+
+
+def measure_load(kind, path):
+    # A fresh process, so that nothing is already imported or cached
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--load", kind, path])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data = create_synthetic_data(args.num_synthetic_articles, np.random.default_rng(0))
+        model_path = args.model_path
+        if not model_path:
+            from BmCS.retrain.retrain_voting import fit_voting_model
+            model_path = os.path.join(tmp_dir, "voting_model.joblib")
+            joblib.dump(fit_voting_model(data, -1), model_path)
+        compact_dir = os.path.join(tmp_dir, "compact")
+        save_compact_voting_model(joblib.load(model_path), compact_dir)
+
+        print(f"{'artifact':<10}{'size (MB)':>11}{'load (s)':>10}{'RSS (MB)':>10}")
+        for kind, path in [("joblib", model_path), ("compact", compact_dir)]:
+            result = measure_load(kind, path)
+            print(f"{kind:<10}{get_size(path)/2**20:>11.1f}{result['load_time']:>10.2f}{result['rss']/2**20:>10.0f}")
+
+        scores = load("joblib", model_path).predict_proba(data)
+        compact_scores = load("compact", compact_dir).predict_proba(data)
+        print(f"Identical predict_proba: {np.array_equal(scores, compact_scores)}")
+
+
+def run_load(kind, path):
+    start_time = time.perf_counter()
+    model = load(kind, path)
+    load_time = time.perf_counter() - start_time
+    with open("/proc/self/statm") as statm_file:
+        rss = int(statm_file.read().split()[1])*PAGE_SIZE
+    print(json.dumps({ "load_time": load_time, "rss": rss }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the size, load time and memory of the voting model artifacts.")
+    parser.add_argument("--model-path", help="Path of voting_model.joblib. A model is trained on synthetic data if omitted.")
+    parser.add_argument("--num-synthetic-articles", type=int, default=20000, help="Training articles if no model is given, and the articles predicted to compare the outputs.")
+    parser.add_argument("--load", nargs=2, metavar=("KIND", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.load:
+        run_load(*args.load)
+    else:
+        run(args)
@@ -0,0 +1,136 @@
+"""Tests of the baseline downloader against a local HTTP server standing in for the NCBI mirror.
+
+Run from the repository root:
+    python -m unittest discover tests
+"""
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from BmCS.retrain import config as cfg
+from BmCS.retrain import download_medline_baseline
+
+
+class _MirrorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, as the NCBI mirror
+
+    def do_GET(self):
+        server = self.server
+        filename = self.path.lstrip("/")
+        with server.lock:
+            server.requests.append((filename, self.headers.get("Range")))
+            fault = server.faults.get(filename, [None]).pop(0) if server.faults.get(filename) else None
+        if filename.endswith(download_medline_baseline.MD5_EXTENSION):
+            content = server.files.get(filename[:-len(download_medline_baseline.MD5_EXTENSION)])
+            body = f"MD5({filename})= {hashlib.md5(content).hexdigest()}\n".encode() if content is not None else None
+        else:
+            body = server.files.get(filename)
+        if body is None or fault == "not_found":
+            self._send(404, b"")
+            return
+        if fault == "corrupt":
+            body = bytes(len(body))
+
+        start = 0
+        requested_range = self.headers.get("Range")
+        if requested_range:
+            start = int(requested_range[len("bytes="):].rstrip("-"))
+        status = 206 if requested_range else 200
+        if fault == "truncate":
+            # Promise the whole body, send half of it and close the connection
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body) - start))
+            self.end_headers()
+            self.wfile.write(body[start:start + (len(body) - start)//2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self._send(status, body[start:])
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DownloaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _MirrorHandler)
+        self.server.files = {}
+        self.server.faults = {}
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        backoff_patch = mock.patch.object(cfg, "DOWNLOAD_RETRY_BACKOFF", 0)
+        backoff_patch.start()
+        self.addCleanup(backoff_patch.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def get_file_requests(self, filename):
+        return [requested_range for requested_filename, requested_range in self.server.requests if requested_filename == filename]
+
+    def test_resumes_truncated_response(self):
+        content = os.urandom(100000)
+        self.server.files["a.xml.gz"] = content
+        self.server.faults["a.xml.gz"] = ["truncate"]
+        filepath = os.path.join(self.tmp_dir.name, "a.xml.gz")
+
+        download_medline_baseline._Downloader(self.base_url, 10).download("a.xml.gz", filepath, 3)
+
+        with open(filepath, "rb") as file:
+            self.assertEqual(file.read(), content)
+        self.assertEqual(self.get_file_requests("a.xml.gz"), [None, f"bytes={len(content)//2}-"])
+
+    def test_retries_md5_mismatch(self):
+        content = os.urandom(1000)
+        self.server.files["a.xml.gz"] = content
+        self.server.faults["a.xml.gz"] = ["corrupt"]
+        filepath = os.path.join(self.tmp_dir.name, "a.xml.gz")
+
+        download_medline_baseline._Downloader(self.base_url, 10).download("a.xml.gz", filepath, 3)
+
+        with open(filepath, "rb") as file:
+            self.assertEqual(file.read(), content)
+        self.assertEqual(self.get_file_requests("a.xml.gz"), [None, None]) # The corrupt file is not resumed
+
+    def test_raises_after_max_retries(self):
+        self.server.files["a.xml.gz"] = os.urandom(1000)
+        self.server.faults["a.xml.gz"] = ["corrupt"]*3
+        filepath = os.path.join(self.tmp_dir.name, "a.xml.gz")
+
+        with self.assertRaises(IOError):
+            download_medline_baseline._Downloader(self.base_url, 10).download("a.xml.gz", filepath, 2)
+        self.assertEqual(len(self.get_file_requests("a.xml.gz")), 3)
+
+    def test_run_stops_at_first_failure(self):
+        num_files = 20
+        for file_num in range(2, num_files + 1):
+            self.server.files[cfg.BASELINE_FILENAME_TEMPLATE.format(file_num)] = os.urandom(1000)
+        settings = { "BASELINE_URL": self.base_url, "DOWNLOAD_MAX_RETRIES": 0, "NUM_BASLINE_FILES": num_files }
+        with mock.patch.multiple(cfg, **settings):
+            with self.assertRaises(IOError):
+                download_medline_baseline.run(self.tmp_dir.name, num_workers=1)
+        downloaded_filenames = os.listdir(os.path.join(self.tmp_dir.name, cfg.MEDLINE_DATA_DIR))
+        self.assertLess(len(downloaded_filenames), num_files - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()